@@ -0,0 +1,114 @@
+import os
+import random
+
+import numpy as np
+
+from agent import Agent
+from cahootsenv import ALL_ACTIONS, CahootsEnv, observation_key
+from qtable import QTable
+from replay import TRANSITION_DTYPE, WIDE_TRANSITION_DTYPE
+
+_env = None  # Every worker process builds its environment once
+
+
+def worker_seed(seed, round_no, worker):
+    # Seed of one actor task, only depends on the run seed, round and worker
+    return int(np.random.SeedSequence([seed, round_no, worker]).generate_state(1)[0])
+
+
+def run_actor(task):
+    """Plays episodes with a read-only copy of the policy.
+
+    The task holds the environment settings, the directory of the policy snapshot
+    (None before the first update), the seed and the epsilon schedule. Returns the
+    transitions as a TRANSITION_DTYPE array plus the episode returns, lengths and
+    number of won games and, if the task asks for it, the profile counters.
+    """
+    global _env
+    if _env is None:
+        _env = CahootsEnv(
+            render_mode=False,
+            number_of_players=task["players"],
+            number_of_missions=task["missions"],
+            outdir=None,
+            engine=task["engine"],
+            obs_mode="key",
+            profile=task["profile"],
+            card_counting=task["card_counting"],
+            action_mask=task["action_mask"],
+            canonical=task["canonical"],
+        )
+    env = _env
+    if env.profiler:
+        env.profiler.reset()
+
+    random.seed(task["seed"])
+    env.action_space.seed(task["seed"])
+    env.cahoots.rng.seed(task["seed"])
+
+    agent = Agent(
+        env=env,
+        learning_rate=0,
+        initial_epsilon=task["epsilon"],
+        epsilon_decay=task["epsilon_decay"],
+        final_epsilon=task["final_epsilon"],
+        discount_factor=0,
+        initial_value=task["initial_value"],
+    )
+    if task["policy"]:
+        agent.q_values = QTable.load(task["policy"], task["initial_value"])
+    if env.profiler:
+        env.profiler.wrap(agent, "get_action_for_key", "get_action")
+
+    transitions = []
+    returns = []
+    lengths = []
+    wons = 0
+    for _ in range(task["episodes"]):
+        obs, info = env.reset(seed=task["env_seed"])
+        key = observation_key(obs)
+        mask = info["action_mask"] if env.masks else None
+        done = False
+        total = 0
+        length = 0
+
+        while not done:
+            action, t = agent.get_action_for_key(env, key, mask)
+            next_obs, reward, terminated, truncated, state = env.step(action)
+            next_key = observation_key(next_obs)
+            next_mask = state["action_mask"] if env.masks else ALL_ACTIONS
+
+            if state["won"]:
+                wons += 1
+
+            transitions.append((key, action, reward, next_key, terminated, next_mask))
+            total += reward
+            length += 1
+
+            done = terminated or truncated
+            key = next_key
+            if env.masks:
+                mask = next_mask
+
+        returns.append(total)
+        lengths.append(length)
+        agent.decay_epsilon()
+
+    return {
+        "transitions": np.array(
+            transitions,
+            dtype=TRANSITION_DTYPE if env.key_words == 1 else WIDE_TRANSITION_DTYPE,
+        ),
+        "returns": np.array(returns, dtype=np.float32),
+        "lengths": np.array(lengths, dtype=np.int32),
+        "wons": wons,
+        "profile": env.profiler and env.profiler.counters,
+    }
+
+
+def save_policy(q_values, directory, round_no):
+    # Writes a snapshot of the Q-table for the actors of the given round
+    path = os.path.join(directory, f"policy-{round_no}")
+    os.mkdir(path)
+    q_values.save(path)
+    return path
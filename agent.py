@@ -1,7 +1,17 @@
-from collections import defaultdict
 import random
 import numpy as np
 
+from cahootsenv import ALL_ACTIONS, legal_actions, observation_key
+from qtable import QTable
+from replay import ReplayBuffer
+from stats import StreamingStats
+
+
+def legal_matrix(masks, n_actions):
+    # (n, n_actions) booleans of a batch of action masks
+    masks = np.asarray(masks, dtype=np.int64)
+    return ((masks[:, None] >> np.arange(n_actions)) & 1) == 1
+
 
 class Agent:
     def __init__(
@@ -13,6 +23,8 @@ class Agent:
         final_epsilon: float,
         discount_factor: float,
         initial_value: float,
+        planning_steps: int = 0,
+        replay_capacity: int = 100000,
     ):
         self.lr = learning_rate
         self.discount_factor = discount_factor
@@ -20,40 +32,187 @@ class Agent:
         self.epsilon = initial_epsilon
         self.epsilon_decay = epsilon_decay
         self.final_epsilon = final_epsilon
-        self.q_values = defaultdict(
-            lambda: np.full(env.action_space.n, self.initial_value)
-        )
 
         self.initial_value = initial_value
 
-        self.training_error = []
+        self.q_values = QTable(
+            env.action_space.n, self.initial_value, key_words=env.key_words
+        )
+
+        self.training_error = StreamingStats()
+
+        # Dyna-style planning: every real update is followed by planning_steps
+        # updates of transitions replayed from the buffer
+        self.planning_steps = planning_steps
+        self.replay = None
+        if planning_steps:
+            self.replay = ReplayBuffer(replay_capacity, env.key_words)
+
+    # The action masks (info["action_mask"] of CahootsEnv(action_mask=True)) are
+    # optional everywhere: with a mask the agent explores and maximizes over the
+    # valid actions only, also for the value of the next state
 
-    def get_action(self, env, obs):
+    def get_action(self, env, obs, mask=None):
+        return self.get_action_for_key(env, observation_key(obs), mask)
+
+    def get_action_for_key(self, env, key, mask=None):
         dice = random.random()
+        if mask is not None:
+            actions = legal_actions(mask)
+            if dice < self.epsilon:
+                return random.choice(actions), 0
+            q = self.q_values.get(key)[actions]
+            m = np.max(q)
+            return actions[random.choice(np.where(q == m)[0])], 1
+
         if dice < self.epsilon:
             return env.action_space.sample(), 0
         else:
-            obs = str(obs)
+            q = self.q_values.get(key)
 
-            m = np.max(self.q_values[obs])
-            action = random.choice(np.where(self.q_values[obs] == m)[0])
+            m = np.max(q)
+            action = random.choice(np.where(q == m)[0])
             return action, 1
 
-    def update(self, env, obs, action, reward, terminated, next_obs):
+    def get_actions(self, keys, masks=None):
+        """Epsilon-greedy actions of a batch of integer state keys.
+
+        Ties between the best actions are broken at random. Returns the actions and
+        a boolean array telling which of them are greedy.
+        """
+        keys = keys.tolist() if isinstance(keys, np.ndarray) else list(keys)
+        q = self.q_values.get_many(keys)
+        n, n_actions = q.shape
+        if masks is not None:
+            legal = legal_matrix(masks, n_actions)
+            q[~legal] = -np.inf
+
+        # A random score for each of the best actions, the highest one wins
+        best = q == q.max(axis=1, keepdims=True)
+        actions = np.argmax(best * np.random.random_sample(q.shape), axis=1)
+
+        if masks is None:
+            explore = np.random.randint(0, n_actions, n)
+        else:
+            explore = np.argmax(legal * np.random.random_sample(q.shape), axis=1)
+        greedy = np.random.random_sample(n) >= self.epsilon
+        actions = np.where(greedy, actions, explore)
+        return actions, greedy
+
+    def update(self, env, obs, action, reward, terminated, next_obs, next_mask=None):
         """Updates the Q-value of an action."""
-        # Convert obs and next_obs to hashable structs
-        obs = str(obs)
-        next_obs = str(next_obs)
+        # Convert obs and next_obs to integer state keys
+        self.update_keys(
+            observation_key(obs),
+            action,
+            reward,
+            terminated,
+            observation_key(next_obs),
+            next_mask,
+        )
 
-        future_q_value = (not terminated) * np.max(self.q_values[next_obs])
-        temporal_difference = (
-            reward + self.discount_factor * future_q_value - self.q_values[obs][action]
+    def update_keys(self, obs, action, reward, terminated, next_obs, next_mask=None):
+        """Updates the Q-value of an action given integer state keys."""
+        self.training_error.add(
+            self._update(obs, action, reward, terminated, next_obs, next_mask)
         )
 
-        self.q_values[obs][action] = (
-            self.q_values[obs][action] + self.lr * temporal_difference
+        if self.replay is not None:
+            if next_mask is None:
+                next_mask = ALL_ACTIONS
+            self.replay.add(obs, action, reward, next_obs, terminated, next_mask)
+            for key, action, reward, next_key, done, next_mask in self.replay.sample(
+                self.planning_steps
+            ).tolist():
+                self._update(key, action, reward, done, next_key, next_mask)
+
+    def _update(self, obs, action, reward, terminated, next_obs, next_mask=None):
+        # One Q-learning step, returns the temporal difference
+        next_q = self.q_values.get(next_obs)
+        if next_mask is not None and next_mask != ALL_ACTIONS:
+            next_q = next_q[legal_actions(next_mask)]
+        future_q_value = (not terminated) * np.max(next_q)
+        q = self.q_values.row(obs)
+        temporal_difference = reward + self.discount_factor * future_q_value - q[action]
+
+        q[action] = q[action] + self.lr * temporal_difference
+        return temporal_difference
+
+    def update_batch(
+        self, keys, actions, rewards, terminated, next_keys, next_masks=None
+    ):
+        """Updates the Q-values of a batch of transitions given integer state keys.
+
+        All targets are taken from the Q-values before the batch. Repeated
+        state-action pairs get the same value as updating them one after the other
+        with these targets. With planning, the batch is added to the replay buffer
+        and planning_steps transitions per transition are replayed as one batch.
+        """
+        self.training_error.add_many(
+            self._update_batch(
+                keys, actions, rewards, terminated, next_keys, next_masks
+            )
         )
-        self.training_error.append(temporal_difference)
+
+        if self.replay is not None:
+            batch = np.zeros(len(actions), dtype=self.replay.data.dtype)
+            batch["key"] = keys
+            batch["action"] = actions
+            batch["reward"] = rewards
+            batch["next_key"] = next_keys
+            batch["done"] = terminated
+            batch["next_mask"] = ALL_ACTIONS if next_masks is None else next_masks
+            self.replay.add_many(batch)
+
+            sample = self.replay.sample(self.planning_steps * len(batch))
+            self._update_batch(
+                sample["key"],
+                sample["action"],
+                sample["reward"],
+                sample["done"],
+                sample["next_key"],
+                sample["next_mask"],
+            )
+
+    def _update_batch(
+        self, keys, actions, rewards, terminated, next_keys, next_masks=None
+    ):
+        # Q-learning steps of a batch, returns the temporal differences
+        keys = keys.tolist() if isinstance(keys, np.ndarray) else list(keys)
+        next_keys = (
+            next_keys.tolist() if isinstance(next_keys, np.ndarray) else list(next_keys)
+        )
+        actions = np.asarray(actions, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=np.float64)
+        terminated = np.asarray(terminated, dtype=bool)
+
+        next_q = self.q_values.get_many(next_keys)
+        if next_masks is not None:
+            next_q[~legal_matrix(next_masks, next_q.shape[1])] = -np.inf
+        future_q_values = np.where(terminated, 0, next_q.max(axis=1))
+        targets = rewards + self.discount_factor * future_q_values
+        rows = self.q_values.rows(keys)
+        values = self.q_values.values
+        temporal_differences = targets - values[rows, actions]
+
+        # k updates of one pair in a row with targets t_1..t_k give
+        # (1 - lr)^k q + sum lr (1 - lr)^(k - i) t_i
+        pairs, inverse, counts = np.unique(
+            rows * values.shape[1] + actions, return_inverse=True, return_counts=True
+        )
+        order = np.argsort(inverse, kind="stable")
+        starts = np.cumsum(counts) - counts
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order)) - np.repeat(starts, counts)
+        decay = 1 - self.lr
+        weights = self.lr * decay ** (counts[inverse] - 1 - position)
+
+        pair_rows = pairs // values.shape[1]
+        pair_actions = pairs % values.shape[1]
+        values[pair_rows, pair_actions] = decay**counts * values[
+            pair_rows, pair_actions
+        ] + np.bincount(inverse, weights * targets, minlength=len(pairs))
+        return temporal_differences
 
     def decay_epsilon(self):
         self.epsilon = max(self.final_epsilon, self.epsilon - self.epsilon_decay)
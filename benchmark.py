@@ -0,0 +1,647 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+
+from agent import Agent
+from cahootsenv import (
+    CahootsEnv,
+    ENGINES,
+    OBSERVATION_MODES,
+    ids_key,
+)
+from cards import CardDeck
+from missionindex import get_mission_index, table_key
+from missions import create_missions
+from players import MCTSPlayer, MissionMinded, Player
+from qtable import QTable
+from vectorenv import VectorCahootsEnv
+
+
+class DefaultHelpFormatter(
+    argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter
+):
+    pass
+
+
+def bench_env(engine, steps, seed, players, missions, obs_mode="dict"):
+    # Plays random actions through the environment and returns env steps/sec
+    env = CahootsEnv(
+        render_mode=False,
+        number_of_players=players,
+        number_of_missions=missions,
+        outdir=None,
+        engine=engine,
+        obs_mode=obs_mode,
+    )
+    actions = random.Random(seed)
+    env.reset(seed=seed)
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        _, _, terminated, _, _ = env.step(actions.randrange(16))
+        if terminated:
+            env.reset()
+    return steps / (time.perf_counter() - start)
+
+
+def bench_engine(engine, steps, seed, players, missions):
+    # Plays random actions directly on the game, the way CahootsEnv.step drives
+    # it, and returns game steps/sec without the observation overhead
+    g = ENGINES[engine](
+        players=[Player(f"Player {no}") for no in range(0, players)],
+        number_of_missions=missions,
+        rng=random.Random(seed),
+    )
+    actions = random.Random(seed)
+    g.reset()
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        action = actions.randrange(16)
+        src, dst = action // 4, action % 4
+        if g.count_moves() == 0:
+            g.finish_turn()
+        elif not g.valid_move(src, dst):
+            g.finish_turn(valid_move=False)
+        else:
+            g.do_move(src, dst)
+            g.finish_turn()
+        if g.get_stats()["finished"]:
+            g.reset()
+    return steps / (time.perf_counter() - start)
+
+
+def bench_vector(num_envs, steps, seed, players, missions):
+    # Steps num_envs games at once with random actions and returns env steps/sec
+    env = VectorCahootsEnv(num_envs, players, missions)
+    actions = np.random.default_rng(seed)
+    env.reset(seed=seed)
+
+    batches = max(1, steps // num_envs)
+    start = time.perf_counter()
+    for _ in range(batches):
+        env.step(actions.integers(0, 16, num_envs))
+    return batches * num_envs / (time.perf_counter() - start)
+
+
+class DeepcopyMissionMinded(MissionMinded):
+    # MissionMinded as it was before push_move/pop_move: the whole game is deep
+    # copied before and restored after every simulated move
+    def get_move(self, g):
+        state = copy.deepcopy(
+            (g.players, g.allcards, g.missions, g.allmissions, g.solved_missions)
+            + (g.table_cards, g.played_cards, g.finished, g.turn)
+            + (g.missions_checked, g.playable)
+        )
+
+        def restore():
+            (
+                g.players,
+                g.allcards,
+                g.missions,
+                g.allmissions,
+                g.solved_missions,
+                g.table_cards,
+                g.played_cards,
+                g.finished,
+                g.turn,
+                g.missions_checked,
+                g.playable,
+            ) = copy.deepcopy(state)
+
+        best_move = None
+        valid_moves = []
+        last_count = -1
+        for src in range(0, 4):
+            for dest in range(0, 4):
+                restore()
+                if not g.valid_move(src, dest):
+                    continue
+                valid_moves.append([src, dest])
+                g.do_move(src, dest)
+                count = g.finish_turn()
+                if count > last_count:
+                    best_move = [src, dest]
+                last_count = count
+        restore()
+        if best_move:
+            return best_move
+        return g.rng.choice(valid_moves)
+
+
+class UndoMissionMinded(MissionMinded):
+    # MissionMinded as it was with push_move/pop_move, before the lookahead
+    # table: every move is played and taken back again
+    def get_move(self, g):
+        best_move = None
+        valid_moves = []
+        last_count = -1
+        for src in range(0, 4):
+            for dest in range(0, 4):
+                if not g.valid_move(src, dest):
+                    continue
+                valid_moves.append([src, dest])
+                count = g.push_move(src, dest)
+                g.pop_move()
+                if count > last_count:
+                    best_move = [src, dest]
+                last_count = count
+        if best_move:
+            return best_move
+        return g.rng.choice(valid_moves)
+
+
+def bench_bot(bot, engine, decisions, seed, players, missions):
+    # Lets bots play complete games and returns the latency of every decision in
+    # seconds
+    g = ENGINES[engine](
+        players=[bot(f"Player {no}") for no in range(0, players)],
+        number_of_missions=missions,
+        rng=random.Random(seed),
+    )
+    g.reset()
+    g.finish_turn(first_time=True)
+
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(decisions):
+            if g.count_moves() == 0:
+                g.finish_turn()
+            else:
+                start = time.perf_counter()
+                src, dest = g.get_player_action()
+                latencies.append(time.perf_counter() - start)
+                g.do_move(src, dest)
+                g.finish_turn()
+            if g.finished:
+                g.reset()
+                g.finish_turn(first_time=True)
+    return np.array(latencies)
+
+
+def bench_mcts(engine, rollouts, seed, players, missions):
+    # Returns the rollouts/sec of an MCTSPlayer deciding the first move of a game
+    g = ENGINES[engine](
+        players=[
+            MCTSPlayer(f"Player {no}", seconds=None, iterations=rollouts, seed=seed)
+            for no in range(0, players)
+        ],
+        number_of_missions=missions,
+        rng=random.Random(seed),
+    )
+    g.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        g.get_player_action()
+    return g.get_current_player().stats["rollouts_per_sec"]
+
+
+def bench_reset(engine, resets, seed, players, missions):
+    # Returns Game.reset calls/sec
+    g = ENGINES[engine](
+        players=[Player(f"Player {no}") for no in range(0, players)],
+        number_of_missions=missions,
+        rng=random.Random(seed),
+    )
+
+    start = time.perf_counter()
+    for _ in range(resets):
+        g.reset()
+    return resets / (time.perf_counter() - start)
+
+
+def bench_finish_turn(engine, steps, seed, players, missions):
+    # Plays random valid moves and returns Game.finish_turn calls/sec, only the
+    # finish_turn calls are timed
+    g = ENGINES[engine](
+        players=[Player(f"Player {no}") for no in range(0, players)],
+        number_of_missions=missions,
+        rng=random.Random(seed),
+    )
+    moves = random.Random(seed)
+    g.reset()
+
+    elapsed = 0
+    for _ in range(steps):
+        valid = [(s, d) for s in range(0, 4) for d in range(0, 4) if g.valid_move(s, d)]
+        if valid:
+            g.do_move(*moves.choice(valid))
+        start = time.perf_counter()
+        g.finish_turn()
+        elapsed += time.perf_counter() - start
+        if g.finished:
+            g.reset()
+    return steps / elapsed
+
+
+def mission_type(mission):
+    # Name of the MissionFactory method that made the mission, e.g. "sum" for
+    # create_sum_mission
+    factory = type(mission).__qualname__.split(".")[1]
+    return factory[len("create_") : -len("_mission")]
+
+
+def bench_mission_tests(tables, seed):
+    # Returns the ns per Mission.test call for every mission type, plus the ns per
+    # lookup in the mission index for comparison
+    rng = random.Random(seed)
+    cards = CardDeck().get_cards()
+    samples = [rng.sample(cards, 4) for _ in range(tables)]
+
+    by_type = {}
+    for mission in create_missions():
+        by_type.setdefault(mission_type(mission), []).append(mission)
+
+    results = {}
+    for name, missions in by_type.items():
+        start = time.perf_counter_ns()
+        for mission in missions:
+            for table in samples:
+                mission.test(table)
+        results[name] = (time.perf_counter_ns() - start) / (len(missions) * tables)
+
+    index = get_mission_index()
+    keys = [table_key([c.id for c in table]) for table in samples]
+    ids = range(0, len(create_missions()))
+    start = time.perf_counter_ns()
+    for mission_id in ids:
+        for key in keys:
+            index.test(mission_id, key)
+    results["index"] = (time.perf_counter_ns() - start) / (len(ids) * tables)
+    return results
+
+
+def bench_agent(steps, seed, players, missions):
+    # Records the transitions of random play, then returns the Agent.get_action
+    # and Agent.update calls/sec on them
+    env = CahootsEnv(
+        render_mode=False,
+        number_of_players=players,
+        number_of_missions=missions,
+        outdir=None,
+        obs_mode="key",
+    )
+    env.action_space.seed(seed)
+    obs, _ = env.reset(seed=seed)
+    transitions = []
+    for _ in range(steps):
+        action = env.action_space.sample()
+        next_obs, reward, terminated, _, _ = env.step(action)
+        transitions.append((obs, action, reward, terminated, next_obs))
+        obs = env.reset()[0] if terminated else next_obs
+
+    # Greedy agent, so get_action always looks at the Q-values
+    agent = Agent(
+        env=env,
+        learning_rate=0.01,
+        initial_epsilon=0,
+        epsilon_decay=0,
+        final_epsilon=0,
+        discount_factor=0.95,
+        initial_value=1000.0,
+    )
+
+    start = time.perf_counter()
+    for obs, action, reward, terminated, next_obs in transitions:
+        agent.update(env, obs, action, reward, terminated, next_obs)
+    update_rate = steps / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for obs, _, _, _, _ in transitions:
+        agent.get_action(env, obs)
+    get_action_rate = steps / (time.perf_counter() - start)
+
+    # The same transitions as arrays with the batch API
+    keys, actions, rewards, terminated, next_keys = (
+        np.array(column) for column in zip(*transitions)
+    )
+    agent.q_values = QTable(env.action_space.n, agent.initial_value)
+    start = time.perf_counter()
+    agent.update_batch(keys, actions, rewards, terminated, next_keys)
+    update_batch_rate = steps / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    agent.get_actions(keys)
+    get_actions_rate = steps / (time.perf_counter() - start)
+
+    return get_action_rate, update_rate, get_actions_rate, update_batch_rate
+
+
+def _train_episodes(episodes, seed, players, missions, results):
+    # Body of the RSS benchmark process: trains the way train.py does
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    env = CahootsEnv(
+        render_mode=False,
+        number_of_players=players,
+        number_of_missions=missions,
+        outdir=None,
+        obs_mode="key",
+    )
+    env.action_space.seed(seed)
+    agent = Agent(
+        env=env,
+        learning_rate=0.01,
+        initial_epsilon=1,
+        epsilon_decay=1 / (episodes / 2),
+        final_epsilon=0.1,
+        discount_factor=0.95,
+        initial_value=1000.0,
+    )
+    for _ in range(episodes):
+        obs, _ = env.reset(seed=seed)
+        done = False
+        while not done:
+            action, _ = agent.get_action(env, obs)
+            next_obs, reward, terminated, truncated, _ = env.step(action)
+            agent.update(env, obs, action, reward, terminated, next_obs)
+            done = terminated or truncated
+            obs = next_obs
+        agent.decay_epsilon()
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((start_rss, peak_rss))
+
+
+def bench_rss(episodes, seed, players, missions):
+    # Trains for the given number of episodes in a fresh process and returns its
+    # peak RSS and how much the peak grew during training, both in MiB
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=_train_episodes, args=(episodes, seed, players, missions, results)
+    )
+    process.start()
+    start_rss, peak_rss = results.get()
+    process.join()
+
+    # ru_maxrss is in KiB on Linux
+    return peak_rss / 1024, (peak_rss - start_rss) / 1024
+
+
+def bench_canonical(episodes, seed, players, missions):
+    # Distinct states of the same random episodes on new deals every episode (as
+    # train.py --seed 0 plays) with the hand of the player to move as dealt and
+    # sorted by face (train.py --canonical), and the memory of Q-tables holding
+    # them
+    env = CahootsEnv(
+        render_mode=False,
+        number_of_players=players,
+        number_of_missions=missions,
+        outdir=None,
+        obs_mode="dict",
+    )
+    env.cahoots.rng.seed(seed)
+    env.action_space.seed(seed)
+    plain = QTable(env.action_space.n, 0.0)
+    canonical = QTable(env.action_space.n, 0.0)
+    for _ in range(episodes):
+        obs, _ = env.reset()
+        done = False
+        while not done:
+            hand = env.cahoots.hand_ids()
+            plain.row(ids_key(obs["current_missions"], obs["table_cards"], hand))
+            canonical.row(
+                ids_key(obs["current_missions"], obs["table_cards"], sorted(hand))
+            )
+            obs, _, done, _, _ = env.step(env.action_space.sample())
+    return len(plain), len(canonical), plain.nbytes(), canonical.nbytes()
+
+
+def run_suite(args):
+    """Runs all benchmarks with fixed seeds and returns the results.
+
+    Every result is a dict with the measured value, its unit and whether higher
+    values are better, keyed by a dotted name such as "env.object.steps_per_sec".
+    The timings are repeated `args.repeat` times and the best value is kept, which
+    is much less noisy than a single run.
+    """
+    results = {}
+
+    def record(name, value, unit, higher_is_better=True):
+        value = float(value)
+        if name in results:
+            better = max if higher_is_better else min
+            value = better(value, results[name]["value"])
+        results[name] = {
+            "value": value,
+            "unit": unit,
+            "higher_is_better": higher_is_better,
+        }
+
+    common = (args.seed, args.players, args.missions)
+
+    for _ in range(args.repeat):
+        _run_timings(args, record, common)
+
+    if args.rss_episodes:
+        peak, growth = bench_rss(args.rss_episodes, *common)
+        record("rss.peak_mib", peak, "MiB", higher_is_better=False)
+        record(
+            "rss.growth_per_10k_episodes_mib",
+            growth * 10000 / args.rss_episodes,
+            "MiB",
+            higher_is_better=False,
+        )
+
+    if args.canonical_episodes:
+        states, canonical_states, nbytes, canonical_nbytes = bench_canonical(
+            args.canonical_episodes, *common
+        )
+        record("canonical.plain_states", states, "states", higher_is_better=False)
+        record("canonical.states", canonical_states, "states", higher_is_better=False)
+        record("canonical.state_reduction", states / canonical_states, "x")
+        record("canonical.plain_mib", nbytes / 2**20, "MiB", higher_is_better=False)
+        record("canonical.mib", canonical_nbytes / 2**20, "MiB", higher_is_better=False)
+
+    for name, result in results.items():
+        print(f"{name:>48}: {result['value']:12.1f} {result['unit']}")
+    return results
+
+
+def _run_timings(args, record, common):
+    # One round of all timing benchmarks
+    for engine in ENGINES:
+        record(
+            f"game.{engine}.reset_per_sec",
+            bench_reset(engine, args.resets, *common),
+            "resets/sec",
+        )
+        record(
+            f"game.{engine}.finish_turn_per_sec",
+            bench_finish_turn(engine, args.steps, *common),
+            "calls/sec",
+        )
+        record(
+            f"game.{engine}.steps_per_sec",
+            bench_engine(engine, args.steps, *common),
+            "steps/sec",
+        )
+        record(
+            f"env.{engine}.steps_per_sec",
+            bench_env(engine, args.steps, *common),
+            "steps/sec",
+        )
+
+    for obs_mode in OBSERVATION_MODES:
+        record(
+            f"env.bitboard.{obs_mode}.steps_per_sec",
+            bench_env("bitboard", args.steps, *common, obs_mode),
+            "steps/sec",
+        )
+
+    record(
+        f"vector.{args.num_envs}.steps_per_sec",
+        bench_vector(args.num_envs, args.steps * 10, *common),
+        "steps/sec",
+    )
+
+    for name, ns in bench_mission_tests(args.tables, args.seed).items():
+        record(f"mission_test.{name}.ns", ns, "ns/call", higher_is_better=False)
+
+    get_action_rate, update_rate, get_actions_rate, update_batch_rate = bench_agent(
+        args.steps, *common
+    )
+    record("agent.get_action_per_sec", get_action_rate, "calls/sec")
+    record("agent.update_per_sec", update_rate, "calls/sec")
+    record("agent.get_actions_per_sec", get_actions_rate, "states/sec")
+    record("agent.update_batch_per_sec", update_batch_rate, "transitions/sec")
+
+    for name, bot, engine in [
+        ("deepcopy", DeepcopyMissionMinded, "object"),
+        ("undo", UndoMissionMinded, "object"),
+        ("undo", UndoMissionMinded, "bitboard"),
+        ("lookahead", MissionMinded, "object"),
+        ("lookahead", MissionMinded, "bitboard"),
+    ]:
+        latencies = bench_bot(bot, engine, args.decisions, *common) * 1e6
+        for stat, value in [
+            ("mean", latencies.mean()),
+            ("p99", np.quantile(latencies, 0.99)),
+        ]:
+            record(
+                f"bot.{name}.{engine}.latency_{stat}_us",
+                value,
+                "us",
+                higher_is_better=False,
+            )
+
+    for engine in ENGINES:
+        record(
+            f"bot.mcts.{engine}.rollouts_per_sec",
+            bench_mcts(engine, args.rollouts, *common),
+            "rollouts/sec",
+        )
+
+
+def compare(results, baseline, threshold):
+    # Prints the change of every result against the baseline and returns the
+    # names of the results that got worse by more than the threshold
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]["value"]
+        new = result["value"]
+        if old <= 0 or new <= 0:
+            continue
+
+        # Slowdown as a fraction, positive means worse
+        if result["higher_is_better"]:
+            slowdown = old / new - 1
+        else:
+            slowdown = new / old - 1
+
+        flag = ""
+        if slowdown > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:>48}: {old:12.1f} -> {new:12.1f} {-slowdown:+8.1%}{flag}")
+    return regressions
+
+
+parser = argparse.ArgumentParser(formatter_class=DefaultHelpFormatter)
+parser.add_argument("--steps", help="number of env steps", default=50000, type=int)
+parser.add_argument("--seed", help="Seed to use", default=42, type=int)
+parser.add_argument("--missions", help="Number of missions", default=8, type=int)
+parser.add_argument("--players", help="Number of players", default=2, type=int)
+parser.add_argument(
+    "--decisions", help="number of bot decisions", default=500, type=int
+)
+parser.add_argument(
+    "--num-envs", help="Number of games in the vector env", default=1024, type=int
+)
+parser.add_argument(
+    "--rollouts", help="number of MCTS rollouts", default=1000, type=int
+)
+parser.add_argument("--resets", help="number of game resets", default=20000, type=int)
+parser.add_argument(
+    "--tables", help="number of tables for the mission tests", default=2000, type=int
+)
+parser.add_argument(
+    "--rss-episodes",
+    help="number of training episodes for the peak RSS measurement (0 to skip)",
+    default=10000,
+    type=int,
+)
+parser.add_argument(
+    "--canonical-episodes",
+    help="number of random episodes in which the distinct states with and without "
+    "train.py --canonical are counted (0 to skip)",
+    default=2000,
+    type=int,
+)
+parser.add_argument(
+    "--repeat", help="Repeat the timings and keep the best", default=3, type=int
+)
+parser.add_argument("--save", help="Write the results to this JSON file", default=None)
+parser.add_argument(
+    "--compare", help="JSON file of an earlier run to compare with", default=None
+)
+parser.add_argument(
+    "--threshold",
+    help="Fail the comparison if a result is more than this fraction worse",
+    default=0.1,
+    type=float,
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    results = run_suite(args)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "args": vars(args),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Results saved to '{args.save}'")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print(f"Compared with '{args.compare}':")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(
+                f"{len(regressions)} result(s) more than {args.threshold:.0%} worse: "
+                + ", ".join(regressions)
+            )
+            sys.exit(1)
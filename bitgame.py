@@ -0,0 +1,528 @@
+import copy
+import random
+
+from cahoots import PLAYED_BITS, UndoEntry
+from cards import CARDS, COMPATIBLE
+from missions import MISSIONS
+from missionindex import get_mission_index, table_key
+from visuals import RenderProcess, Visuals
+
+# Cards are encoded as small integers: code = face * 2 + copy, where face is the
+# Card.id (color index * 7 + number - 1) and copy distinguishes the two physical
+# cards of the same face. This is the same order in which CardDeck builds its deck,
+# so shuffling range(56) consumes the RNG exactly like CardDeck does.
+NUMBER_OF_CARDS = 56
+EMPTY = 63  # Marker for an empty hand slot
+SLOT_BITS = 6
+SLOT_MASK = (1 << SLOT_BITS) - 1
+
+# The card catalog of cards.py is ordered by code, CARDS[code] is the Card object
+# of a code, only used for missions and rendering
+ATTR = []  # Color/number mask of every code: bits 0-3 color, bits 4-10 number
+for _code in range(NUMBER_OF_CARDS):
+    _face = _code >> 1
+    ATTR.append((1 << (_face // 7)) | (1 << (4 + _face % 7)))
+
+# COMPAT[code] has bit c set if card c may be played on top of card code. EMPTY
+# is beyond the last card, so an empty hand slot fits nowhere.
+COMPAT = []
+for _dst in range(NUMBER_OF_CARDS):
+    _mask = 0
+    for _src in range(NUMBER_OF_CARDS):
+        if (COMPATIBLE[_dst >> 1] >> (_src >> 1)) & 1:
+            _mask |= 1 << _src
+    COMPAT.append(_mask)
+
+# Weight of the face on every table position in table_key
+KEY_WEIGHTS = [28**3, 28**2, 28, 1]
+COLUMN_MASK = 0x1111  # Bits of the moves onto table position 0 in a playable mask
+
+
+def pack(codes):
+    # Packs four card codes into one word
+    word = 0
+    for pos, code in enumerate(codes):
+        word |= code << (SLOT_BITS * pos)
+    return word
+
+
+def unpack(word):
+    # Unpacks a word into four card codes
+    return [
+        word & SLOT_MASK,
+        (word >> 6) & SLOT_MASK,
+        (word >> 12) & SLOT_MASK,
+        (word >> 18) & SLOT_MASK,
+    ]
+
+
+# Face id of every code, -1 for EMPTY
+FACE_IDS = [code >> 1 for code in range(0, NUMBER_OF_CARDS)]
+FACE_IDS += [-1] * (EMPTY + 1 - NUMBER_OF_CARDS)
+
+
+class BitGame:
+    """Drop-in replacement for cahoots.Game that keeps the state as integers.
+
+    The table and every hand are packed words of four 6 bit card codes. Like
+    Game, the valid moves of every player are kept as 16 bit playable masks that
+    are updated after every move, and the table_key of the table faces is kept up
+    to date, so checking moves and missions never unpacks the table.
+    """
+
+    def __init__(
+        self,
+        players,
+        number_of_missions,
+        outdir=None,
+        render_process=False,
+        rng=None,
+    ):
+        self.players = players  # Array of the players
+        self.allcards = []  # The closed card deck (codes)
+        self.missions = []  # The current missions
+        self.missions_checked = []  # Whether a mission is known unsolved on the table
+        self.solved_missions = []  # The stack of solved missions
+        self.table = 0  # Packed codes of the cards on the table
+        self.table_key = 0  # table_key of the faces on the table
+        self.hands = []  # Packed codes of the cards in the hand of every player
+        self.playable = []  # Mask of the valid moves of every player
+        self.played_cards = []  # The codes that have been played
+        self.played_counts = 0  # Played copies of every face, see PLAYED_BITS
+        self.undo_log = []  # Moves played with push_move that can be undone
+
+        self.number_of_missions = (
+            number_of_missions  # Total number of missions to solve
+        )
+
+        self.player_index = {id(player): i for i, player in enumerate(players)}
+
+        self.id = 0
+
+        # Every game shuffles with its own generator, so games never disturb each
+        # other's random streams
+        self.rng = rng if rng is not None else random.Random()
+
+        self.outdir = outdir
+
+        # Rendering in a separate process keeps pygame and disk writes off this one
+        if render_process:
+            self.v = RenderProcess(outdir)
+        else:
+            self.v = Visuals(outdir)
+
+    def reset(self):
+        # Reset players turns and flush the played card stacks
+        self.turn = 0
+        self.id += 1
+        self.played_cards = []
+        self.played_counts = 0
+        self.solved_missions = []
+        self.undo_log = []
+
+        self.finished = False
+
+        # Get a random set of mission cards, shuffled like MissionDeck does
+        order = list(range(0, len(MISSIONS)))
+        self.rng.shuffle(order)
+        self.allmissions = [MISSIONS[i] for i in order[0 : self.number_of_missions]]
+        self.total_possible_missions = len(MISSIONS)
+
+        # Get the playing cards in random order, shuffled like CardDeck does
+        self.allcards = list(range(0, NUMBER_OF_CARDS))
+        self.rng.shuffle(self.allcards)
+
+        # Initialize the missions
+        self.missions = []
+        count = min(self.number_of_missions, 4)
+        for i in range(0, count):
+            self.missions.append(self.allmissions.pop())
+        self.missions_checked = [False] * count
+
+        # Deal cards on the playing deck
+        table = [self.allcards.pop() for _ in range(0, 4)]
+        self.table = pack(table)
+        self.table_key = table_key([code >> 1 for code in table])
+
+        # Deal cards to the players
+        self.hands = []
+        for player in self.players:
+            player.reset()
+            self.hands.append(pack([self.allcards.pop() for _ in range(0, 4)]))
+        self.update_playable()
+
+    def _index(self, player):
+        if player is None:
+            return self.turn
+        return self.player_index[id(player)]
+
+    def table_codes(self):
+        return unpack(self.table)
+
+    def hand_codes(self, player=None):
+        return unpack(self.hands[self._index(player)])
+
+    def table_ids(self):
+        table = self.table
+        return [
+            (table & SLOT_MASK) >> 1,
+            ((table >> 6) & SLOT_MASK) >> 1,
+            ((table >> 12) & SLOT_MASK) >> 1,
+            ((table >> 18) & SLOT_MASK) >> 1,
+        ]
+
+    def hand_ids(self, player=None):
+        hand = self.hands[self._index(player)]
+        return [
+            FACE_IDS[hand & SLOT_MASK],
+            FACE_IDS[(hand >> 6) & SLOT_MASK],
+            FACE_IDS[(hand >> 12) & SLOT_MASK],
+            FACE_IDS[(hand >> 18) & SLOT_MASK],
+        ]
+
+    def mission_ids(self):
+        return [m.id if m else -1 for m in self.missions]
+
+    def played_ids(self):
+        return [code >> 1 for code in self.played_cards]
+
+    @property
+    def table_cards(self):
+        return [CARDS[code] for code in unpack(self.table)]
+
+    def hand_cards(self, player=None):
+        return [
+            None if code == EMPTY else CARDS[code]
+            for code in unpack(self.hands[self._index(player)])
+        ]
+
+    def get_remaining_missions(self):
+        # Returns the amount of missions to play: the one on the table plus closed stack
+        result = [x for x in self.missions if x]
+        result.extend(self.allmissions)
+        return result
+
+    def count_remaining_missions(self):
+        # Same as len(self.get_remaining_missions()) without building the list
+        count = len(self.allmissions)
+        for x in self.missions:
+            if x:
+                count += 1
+        return count
+
+    def get_stats(self):
+        return {
+            "missions_total": self.number_of_missions,
+            "missions_remaining": self.get_remaining_missions(),
+            "missions_solved": self.solved_missions,
+            "cards_left": len(self.allcards),
+            "finished": self.finished,
+        }
+
+    def get_current_player(self):
+        return self.players[self.turn]
+
+    def clone(self):
+        # Copy of the game that can be played on without touching this one
+        g = copy.copy(self)
+        g.allcards = list(self.allcards)
+        g.missions = list(self.missions)
+        g.missions_checked = list(self.missions_checked)
+        g.allmissions = list(self.allmissions)
+        g.solved_missions = list(self.solved_missions)
+        g.hands = list(self.hands)
+        g.playable = list(self.playable)
+        g.played_cards = list(self.played_cards)
+        g.rng = copy.copy(self.rng)
+        g.undo_log = []
+        return g
+
+    def restore(self, snapshot):
+        # Puts the game back into the state of a clone, e.g. a cached initial deal,
+        # as if it was reset. The snapshot is not modified and can be restored
+        # again.
+        self.turn = snapshot.turn
+        self.id += 1
+        self.finished = snapshot.finished
+        self.total_possible_missions = snapshot.total_possible_missions
+        self.allcards = list(snapshot.allcards)
+        self.missions = list(snapshot.missions)
+        self.missions_checked = list(snapshot.missions_checked)
+        self.allmissions = list(snapshot.allmissions)
+        self.solved_missions = list(snapshot.solved_missions)
+        self.table = snapshot.table
+        self.table_key = snapshot.table_key
+        self.hands = list(snapshot.hands)
+        self.playable = list(snapshot.playable)
+        self.played_cards = list(snapshot.played_cards)
+        self.played_counts = snapshot.played_counts
+        self.rng.setstate(snapshot.rng.getstate())
+        self.undo_log = []
+
+    def sample_hidden(self, rng):
+        # Replaces what the current player cannot see by a random guess that is
+        # consistent with what they can see: the cards of the other players and the
+        # deck are dealt again from the same cards, and the mission stack is drawn
+        # from the missions that have not been shown yet. Meant for clones.
+        others = [p for p in range(0, len(self.players)) if p != self.turn]
+
+        codes = list(self.allcards)
+        for p in others:
+            codes.extend(code for code in unpack(self.hands[p]) if code != EMPTY)
+        rng.shuffle(codes)
+        for p in others:
+            hand = [
+                EMPTY if code == EMPTY else codes.pop()
+                for code in unpack(self.hands[p])
+            ]
+            self.hands[p] = pack(hand)
+        self.allcards = codes
+        self.update_playable()
+
+        shown = {id(m) for m in self.missions + self.solved_missions if m}
+        unseen = [m for m in MISSIONS if id(m) not in shown]
+        self.allmissions = rng.sample(unseen, len(self.allmissions))
+
+    def push_move(self, src, dest):
+        # Plays a move and finishes the turn, remembering what is needed to undo it
+        entry = UndoEntry(
+            src,
+            dest,
+            (self.hands[self.turn] >> (SLOT_BITS * src)) & SLOT_MASK,
+            (self.table >> (SLOT_BITS * dest)) & SLOT_MASK,
+            list(self.missions),
+            list(self.missions_checked),
+            list(self.playable),
+            len(self.solved_missions),
+            self.turn,
+            self.finished,
+        )
+        self.undo_log.append(entry)
+
+        self.do_move(src, dest)
+        entry.drawn = (self.hands[self.turn] >> (SLOT_BITS * src)) & SLOT_MASK
+        return self.finish_turn()
+
+    def pop_move(self):
+        # Undoes the last move played with push_move
+        entry = self.undo_log.pop()
+
+        self.allmissions.extend(reversed(entry.popped))
+        self.missions = entry.missions
+        self.missions_checked = entry.checked
+        self.playable = entry.playable
+        del self.solved_missions[entry.solved :]
+        self.turn = entry.turn
+        self.finished = entry.finished
+
+        p = self.turn
+        src_shift = SLOT_BITS * entry.src
+        dest_shift = SLOT_BITS * entry.dest
+        if entry.drawn != EMPTY:
+            self.allcards.append(entry.drawn)
+        self.hands[p] = (self.hands[p] & ~(SLOT_MASK << src_shift)) | (
+            entry.srccard << src_shift
+        )
+        self.table = (self.table & ~(SLOT_MASK << dest_shift)) | (
+            entry.dstcard << dest_shift
+        )
+        self.table_key += ((entry.dstcard >> 1) - (entry.srccard >> 1)) * KEY_WEIGHTS[
+            entry.dest
+        ]
+        self.played_cards.pop()
+        self.played_counts -= 1 << (PLAYED_BITS * (entry.dstcard >> 1))
+
+    def check_missions(self):
+        # Checks the missions that are not known to be unsolved for completion
+        fulfilled = False
+        index = get_mission_index()
+        key = self.table_key
+
+        for pos, mission in enumerate(self.missions):
+            if not mission or self.missions_checked[pos]:
+                continue
+            if not index.test(mission.id, key):
+                self.missions_checked[pos] = True
+                continue
+            fulfilled = True
+            self.solved_missions.append(mission)
+            self.missions_checked[pos] = False
+            if self.allmissions:
+                self.missions[pos] = self.allmissions.pop()
+                if self.undo_log:
+                    self.undo_log[-1].popped.append(self.missions[pos])
+            else:
+                self.missions[pos] = None
+        return fulfilled
+
+    def uncheck_missions(self, pos, old, new):
+        # Marks the missions that may be solved after replacing face old by face new
+        # on the given table position for testing
+        index = get_mission_index()
+        for i, mission in enumerate(self.missions):
+            if self.missions_checked[i] and index.depends(mission.id, pos, old, new):
+                self.missions_checked[i] = False
+
+    def next_player(self):
+        # Switch to the next player
+        self.turn = (self.turn + 1) % len(self.players)
+
+    def do_move(self, src, dest):
+        # Moves a card from the players hand to the deck
+        p = self.turn
+        src_shift = SLOT_BITS * src
+        dest_shift = SLOT_BITS * dest
+        hand = self.hands[p]
+        srccard = (hand >> src_shift) & SLOT_MASK
+
+        # Add old cards to the stack of played cards
+        dstcard = (self.table >> dest_shift) & SLOT_MASK
+        self.played_cards.append(dstcard)
+        self.played_counts += 1 << (PLAYED_BITS * (dstcard >> 1))
+        self.table = (self.table & ~(SLOT_MASK << dest_shift)) | (srccard << dest_shift)
+        self.table_key += ((srccard >> 1) - (dstcard >> 1)) * KEY_WEIGHTS[dest]
+
+        # Missions that cannot be affected by this change stay checked
+        if srccard >> 1 != dstcard >> 1:
+            self.uncheck_missions(dest, dstcard >> 1, srccard >> 1)
+
+        # If there are cards left, pick a card
+        newcard = self.allcards.pop() if self.allcards else EMPTY
+        self.hands[p] = (hand & ~(SLOT_MASK << src_shift)) | (newcard << src_shift)
+
+        self.update_playable(src, dest)
+
+    def _hand_row(self, code):
+        # Mask of the stacks on the table the card can be played on
+        table = self.table
+        return (
+            ((COMPAT[table & SLOT_MASK] >> code) & 1)
+            | (((COMPAT[(table >> 6) & SLOT_MASK] >> code) & 1) << 1)
+            | (((COMPAT[(table >> 12) & SLOT_MASK] >> code) & 1) << 2)
+            | (((COMPAT[(table >> 18) & SLOT_MASK] >> code) & 1) << 3)
+        )
+
+    def update_playable(self, src=None, dest=None):
+        # Keeps the playable masks up to date like Game.update_playable: with no
+        # arguments all masks are rebuilt, otherwise only the hand slot src of the
+        # current player and the table stack dest of all players are updated
+        if src is None and dest is None:
+            self.playable = []
+            for hand in self.hands:
+                mask = 0
+                for i, code in enumerate(unpack(hand)):
+                    mask |= self._hand_row(code) << (4 * i)
+                self.playable.append(mask)
+            return
+
+        if dest is not None:
+            fits = COMPAT[(self.table >> (SLOT_BITS * dest)) & SLOT_MASK]
+            column = COLUMN_MASK << dest
+            for p, hand in enumerate(self.hands):
+                bits = (
+                    ((fits >> (hand & SLOT_MASK)) & 1)
+                    | (((fits >> ((hand >> 6) & SLOT_MASK)) & 1) << 4)
+                    | (((fits >> ((hand >> 12) & SLOT_MASK)) & 1) << 8)
+                    | (((fits >> ((hand >> 18) & SLOT_MASK)) & 1) << 12)
+                )
+                self.playable[p] = (self.playable[p] & ~column) | (bits << dest)
+
+        if src is not None:
+            p = self.turn
+            code = (self.hands[p] >> (SLOT_BITS * src)) & SLOT_MASK
+            mask = self.playable[p] & ~(0xF << (4 * src))
+            self.playable[p] = mask | (self._hand_row(code) << (4 * src))
+
+    def count_moves(self, player=None):
+        # Count the number of valid moves for the given player
+        return self.playable[self._index(player)].bit_count()
+
+    def legal_mask(self, player=None):
+        # The valid moves of the player as a 16 bit mask, bit 4 * src + dest
+        return self.playable[self._index(player)]
+
+    def valid_move(self, src, dest, player=None):
+        # Check if a move is valid
+        return (self.playable[self._index(player)] >> (4 * src + dest)) & 1 == 1
+
+    def finish_turn(self, first_time=False, valid_move=True):
+        # Checks for solved missions and if the game has ended
+        # Note that it is possible to solve multiple missions at once
+
+        solved_mission = True  # Whether or not a mission was finished
+        solved_mission_count = 0  # Total number of missions finished in this round
+
+        while solved_mission:
+            solved_mission = self.check_missions()
+            if solved_mission:
+                solved_mission_count += 1
+
+        # Check if we have won the game
+        if not self.allmissions and not any(self.missions):
+            self.finished = True
+            return solved_mission_count
+
+        # Check if there are still possible moves
+        if not any(self.playable):
+            self.finished = True
+            return solved_mission_count
+
+        # Determine the next player
+        # At the beginning of the game, if a mission is solved by coincedence, don't
+        # switch to next player
+        if valid_move and solved_mission_count == 0 and not first_time:
+            self.next_player()
+
+        return solved_mission_count
+
+    def get_player_action(self):
+        # Ask the Player class for an action
+        player = self.get_current_player()
+        [src, dest] = player.get_move(self)
+        return [src, dest]
+
+    def visual_render(self):
+        description = (
+            f"{self.get_current_player().player} - Ep: {self.id} - Cards left: {len(self.allcards)} "
+            f"- Missions left:{len(self.get_remaining_missions())}"
+        )
+
+        self.v.draw(
+            self.missions,
+            self.table_cards,
+            self.hand_cards(),
+            description,
+        )
+
+    def print(self, extended=True):
+        self.visual_render()
+
+        print(
+            f"*** Missions left: {len(self.allmissions)} *** Cards left: {len(self.allcards)} ***"
+        )
+        print("Current Missions:")
+        for m in self.missions:
+            if m:
+                print(f"- {m}")
+            else:
+                print("- ------")
+
+        print()
+
+        player = self.get_current_player()
+        hand = self.hand_cards()
+        table = self.table_cards
+
+        print("# - P - D")
+        for i in range(0, 4):
+            print(f"{i} - {hand[i]} - {table[i]}")
+
+        print()
+
+        if extended:
+            print("Played cards:", [CARDS[code] for code in self.played_cards])
+            print("Played missions:", self.solved_missions)
+
+        print()
+        print(f"It's Player {player.player}'s turn")
+        return
@@ -1,16 +1,79 @@
-from cards import CardDeck
-from missions import MissionDeck
-from visuals import Visuals
+import copy
+import random
+
+from cards import COMPATIBLE, CardDeck
+from missions import MISSIONS, MissionDeck
+from missionindex import get_mission_index, table_key
+from visuals import RenderProcess, Visuals
+
+# The number of played copies of every face is counted in one integer, PLAYED_BITS
+# bits per face: face f at bits PLAYED_BITS * f and up
+PLAYED_BITS = 2
+
+
+class UndoEntry:
+    # The fields of the game touched by a single push_move
+    __slots__ = [
+        "src",
+        "dest",
+        "srccard",
+        "dstcard",
+        "drawn",
+        "missions",
+        "checked",
+        "playable",
+        "solved",
+        "popped",
+        "turn",
+        "finished",
+    ]
+
+    def __init__(
+        self,
+        src,
+        dest,
+        srccard,
+        dstcard,
+        missions,
+        checked,
+        playable,
+        solved,
+        turn,
+        finished,
+    ):
+        self.src = src
+        self.dest = dest
+        self.srccard = srccard  # The card that left the hand
+        self.dstcard = dstcard  # The card that was covered on the table
+        self.drawn = None  # The card drawn from the deck, if any
+        self.missions = missions  # The mission slots before the move
+        self.checked = checked  # The checked flags of the mission slots
+        self.playable = playable  # The playable masks of the players
+        self.solved = solved  # Number of solved missions before the move
+        self.popped = []  # Missions drawn from allmissions, in order
+        self.turn = turn
+        self.finished = finished
 
 
 class Game:
-    def __init__(self, players, number_of_missions, outdir=None):
+    def __init__(
+        self,
+        players,
+        number_of_missions,
+        outdir=None,
+        render_process=False,
+        rng=None,
+    ):
         self.players = players  # Array of the players
         self.allcards = []  # The closed card deck
         self.missions = []  # The current missions
+        self.missions_checked = []  # Whether a mission is known unsolved on the table
         self.solved_missions = []  # The stack of solved missions
         self.table_cards = []  # The current cards on the table
         self.played_cards = []  # The cards that have been played
+        self.played_counts = 0  # Played copies of every face, see PLAYED_BITS
+        self.playable = []  # Mask of the valid moves of every player
+        self.undo_log = []  # Moves played with push_move that can be undone
 
         self.number_of_missions = (
             number_of_missions  # Total number of missions to solve
@@ -18,26 +81,36 @@ class Game:
 
         self.id = 0
 
+        # Every game shuffles with its own generator, so games never disturb each
+        # other's random streams
+        self.rng = rng if rng is not None else random.Random()
+
         self.outdir = outdir
 
-        self.v = Visuals(outdir)
+        # Rendering in a separate process keeps pygame and disk writes off this one
+        if render_process:
+            self.v = RenderProcess(outdir)
+        else:
+            self.v = Visuals(outdir)
 
     def reset(self):
         # Reset players turns and flush the played card stacks
         self.turn = 0
         self.id += 1
         self.played_cards = []
+        self.played_counts = 0
         self.solved_missions = []
+        self.undo_log = []
 
         self.finished = False
 
         # Get a random set of mission cards
-        missionsDeck = MissionDeck()
+        missionsDeck = MissionDeck(self.rng)
         self.allmissions = missionsDeck.get_missions(self.number_of_missions)
         self.total_possible_missions = missionsDeck.total_mission_count()
 
         # Get the playing cards in random order
-        cardDeck = CardDeck()
+        cardDeck = CardDeck(self.rng)
         self.allcards = cardDeck.get_cards()
 
         # Initialize the missions
@@ -47,6 +120,7 @@ class Game:
             count = 4
         for i in range(0, count):
             self.missions.append(self.allmissions.pop())
+        self.missions_checked = [False] * count
 
         # Deal cards on the playing deck
         self.table_cards = []
@@ -59,6 +133,8 @@ class Game:
             for _ in range(0, 4):
                 player.add_card(self.allcards.pop())
 
+        self.update_playable()
+
     def get_remaining_missions(self):
         # Returns the amount of missions to play: the one on the table plus closed stack
         result = []
@@ -69,6 +145,14 @@ class Game:
             result.append(x)
         return result
 
+    def count_remaining_missions(self):
+        # Same as len(self.get_remaining_missions()) without building the list
+        count = len(self.allmissions)
+        for x in self.missions:
+            if x:
+                count += 1
+        return count
+
     def get_stats(self):
         return {
             "missions_total": self.number_of_missions,
@@ -81,19 +165,154 @@ class Game:
     def get_current_player(self):
         return self.players[self.turn]
 
+    def table_ids(self):
+        return [c.id for c in self.table_cards]
+
+    def hand_ids(self, player=None):
+        if not player:
+            player = self.get_current_player()
+        return [c.id if c else -1 for c in player.cards]
+
+    def mission_ids(self):
+        return [m.id if m else -1 for m in self.missions]
+
+    def played_ids(self):
+        return [c.id for c in self.played_cards]
+
+    def hand_cards(self, player=None):
+        if not player:
+            player = self.get_current_player()
+        return player.cards
+
+    def clone(self):
+        # Copy of the game that can be played on without touching this one. Cards
+        # and missions are never modified, so only the containers are copied.
+        g = copy.copy(self)
+        g.players = []
+        for player in self.players:
+            p = copy.copy(player)
+            p.cards = list(player.cards)
+            g.players.append(p)
+        g.allcards = list(self.allcards)
+        g.missions = list(self.missions)
+        g.missions_checked = list(self.missions_checked)
+        g.playable = list(self.playable)
+        g.allmissions = list(self.allmissions)
+        g.solved_missions = list(self.solved_missions)
+        g.table_cards = list(self.table_cards)
+        g.played_cards = list(self.played_cards)
+        g.rng = copy.copy(self.rng)
+        g.undo_log = []
+        return g
+
+    def restore(self, snapshot):
+        # Puts the game back into the state of a clone, e.g. a cached initial deal,
+        # as if it was reset. The snapshot is not modified and can be restored
+        # again.
+        self.turn = snapshot.turn
+        self.id += 1
+        self.finished = snapshot.finished
+        self.total_possible_missions = snapshot.total_possible_missions
+        for player, saved in zip(self.players, snapshot.players):
+            player.cards = list(saved.cards)
+        self.allcards = list(snapshot.allcards)
+        self.missions = list(snapshot.missions)
+        self.missions_checked = list(snapshot.missions_checked)
+        self.playable = list(snapshot.playable)
+        self.allmissions = list(snapshot.allmissions)
+        self.solved_missions = list(snapshot.solved_missions)
+        self.table_cards = list(snapshot.table_cards)
+        self.played_cards = list(snapshot.played_cards)
+        self.played_counts = snapshot.played_counts
+        self.rng.setstate(snapshot.rng.getstate())
+        self.undo_log = []
+
+    def sample_hidden(self, rng):
+        # Replaces what the current player cannot see by a random guess that is
+        # consistent with what they can see: the cards of the other players and the
+        # deck are dealt again from the same cards, and the mission stack is drawn
+        # from the missions that have not been shown yet. Meant for clones.
+        me = self.get_current_player()
+        others = [p for p in self.players if p is not me]
+
+        cards = list(self.allcards)
+        for player in others:
+            cards.extend(c for c in player.cards if c)
+        rng.shuffle(cards)
+        for player in others:
+            player.cards = [cards.pop() if c else None for c in player.cards]
+        self.allcards = cards
+
+        shown = {id(m) for m in self.missions + self.solved_missions if m}
+        unseen = [m for m in MISSIONS if id(m) not in shown]
+        self.allmissions = rng.sample(unseen, len(self.allmissions))
+
+        self.update_playable()
+
+    def push_move(self, src, dest):
+        # Plays a move and finishes the turn, remembering what is needed to undo it
+        player = self.get_current_player()
+        entry = UndoEntry(
+            src,
+            dest,
+            player.cards[src],
+            self.table_cards[dest],
+            list(self.missions),
+            list(self.missions_checked),
+            list(self.playable),
+            len(self.solved_missions),
+            self.turn,
+            self.finished,
+        )
+        self.undo_log.append(entry)
+
+        self.do_move(src, dest)
+        entry.drawn = player.cards[src]
+        return self.finish_turn()
+
+    def pop_move(self):
+        # Undoes the last move played with push_move
+        entry = self.undo_log.pop()
+
+        self.allmissions.extend(reversed(entry.popped))
+        self.missions = entry.missions
+        self.missions_checked = entry.checked
+        self.playable = entry.playable
+        del self.solved_missions[entry.solved :]
+        self.turn = entry.turn
+        self.finished = entry.finished
+
+        if entry.drawn:
+            self.allcards.append(entry.drawn)
+        self.get_current_player().cards[entry.src] = entry.srccard
+        self.table_cards[entry.dest] = entry.dstcard
+        self.played_cards.pop()
+        self.played_counts -= 1 << (PLAYED_BITS * entry.dstcard.id)
+
     def check_missions(self):
-        # Checks all missions for completion
+        # Checks all missions for completion. Missions that are already known to be
+        # unsolved on the current table are skipped, so after the first pass only
+        # the replacement missions are tested again.
         fulfilled = False
+        index = get_mission_index()
+        key = table_key(self.table_ids())
 
         pos = 0
         while pos < len(self.missions):
             mission = self.missions[pos]
-            if mission and mission.test(self.table_cards):
+            if mission and not self.missions_checked[pos]:
+                if not index.test(mission.id, key):
+                    self.missions_checked[pos] = True
+                    pos += 1
+                    continue
                 # print (f"\n--> Fulfilled: {mission.desc}\n")
                 fulfilled = True
                 self.solved_missions.append(mission)
+                self.missions_checked[pos] = False
                 if self.allmissions:
                     self.missions[pos] = self.allmissions.pop()
+                    if self.undo_log:
+                        self.undo_log[-1].popped.append(self.missions[pos])
                 else:
                     self.missions[pos] = None
             pos += 1
@@ -110,42 +329,91 @@ class Game:
         srccard = player.cards[src]
 
         # Add old cards to the stack of played cards
-        self.played_cards.append(self.table_cards[dest])
+        dstcard = self.table_cards[dest]
+        self.played_cards.append(dstcard)
+        self.played_counts += 1 << (PLAYED_BITS * dstcard.id)
         self.table_cards[dest] = srccard
 
+        # Missions that cannot be affected by this change stay checked
+        if srccard.id != dstcard.id:
+            self.uncheck_missions(dest, dstcard.id, srccard.id)
+
         # If there are cards left, pick a card
         if self.allcards:
             player.cards[src] = self.allcards.pop()
         else:
             player.cards[src] = None
 
+        self.update_playable(src, dest)
+
+    def uncheck_missions(self, pos, old, new):
+        # Marks the missions that may be solved after replacing face old by face new
+        # on the given table position for testing
+        index = get_mission_index()
+        for i, mission in enumerate(self.missions):
+            if self.missions_checked[i] and index.depends(mission.id, pos, old, new):
+                self.missions_checked[i] = False
+
+    def _player_index(self, player):
+        if not player:
+            return self.turn
+        return self.players.index(player)
+
+    def _hand_row(self, card):
+        # Mask of the stacks on the table the card can be played on
+        if not card:
+            return 0
+        compatible = COMPATIBLE[card.id]
+        mask = 0
+        for dest, table_card in enumerate(self.table_cards):
+            if (compatible >> table_card.id) & 1:
+                mask |= 1 << dest
+        return mask
+
+    def update_playable(self, src=None, dest=None):
+        # Keeps the playable masks up to date: bit src * 4 + dest of a player's
+        # mask is set if that move is valid. With no arguments all masks are
+        # rebuilt, otherwise only the hand slot src of the current player and the
+        # table stack dest of all players are updated.
+        if src is None and dest is None:
+            self.playable = []
+            for player in self.players:
+                mask = 0
+                for i, card in enumerate(player.cards):
+                    mask |= self._hand_row(card) << (4 * i)
+                self.playable.append(mask)
+            return
+
+        if dest is not None:
+            table_id = self.table_cards[dest].id
+            for p, player in enumerate(self.players):
+                mask = self.playable[p]
+                for i, card in enumerate(player.cards):
+                    bit = 1 << (4 * i + dest)
+                    if card and (COMPATIBLE[card.id] >> table_id) & 1:
+                        mask |= bit
+                    else:
+                        mask &= ~bit
+                self.playable[p] = mask
+
+        if src is not None:
+            p = self.turn
+            card = self.players[p].cards[src]
+            mask = self.playable[p] & ~(0xF << (4 * src))
+            self.playable[p] = mask | (self._hand_row(card) << (4 * src))
+
     def count_moves(self, player=None):
         # Count the number of valid moves for the given player
-        if not player:
-            player = self.get_current_player()
+        return self.playable[self._player_index(player)].bit_count()
 
-        count = 0
-        for src in range(0, 4):
-            for dest in range(0, 4):
-                if self.valid_move(src, dest, player):
-                    count += 1
-        return count
+    def legal_mask(self, player=None):
+        # The valid moves of the player as a 16 bit mask, bit 4 * src + dest
+        return self.playable[self._player_index(player)]
 
     def valid_move(self, src, dest, player=None):
         # Check if a move is valid
-        if not player:
-            player = self.get_current_player()
-
-        srccard = player.cards[src]
-        if not srccard:
-            return False
-
-        dstcard = self.table_cards[dest]
-        if srccard.color == dstcard.color:
-            return True
-        if srccard.number == dstcard.number:
-            return True
-        return False
+        mask = self.playable[self._player_index(player)]
+        return (mask >> (4 * src + dest)) & 1 == 1
 
     def finish_turn(self, first_time=False, valid_move=True):
         # Checks for solved missions and if the game has ended
@@ -165,12 +433,7 @@ class Game:
             return solved_mission_count
 
         # Check if there are still possible moves
-        total_moves = 0
-        for player in self.players:
-            # print (f"{player.player} has {self.count_moves(player)} moves")
-            total_moves += self.count_moves(player)
-
-        if total_moves == 0:
+        if not any(self.playable):
             # print ("No valid moves... game over")
             self.finished = True
             return solved_mission_count
@@ -1,11 +1,21 @@
-import random
+import functools
 
-from cahoots import Game
+import numpy as np
+
+from cahoots import PLAYED_BITS, Game
+from bitgame import BitGame
+from missionindex import NUMBER_OF_FACES
 from players import Player
+from profiling import Profiler
 from gymnasium import spaces
 
 import gymnasium as gym
 
+ENGINES = {
+    "object": Game,
+    "bitboard": BitGame,
+}
+
 REWARDS = {
     "INVALID_MOVE": -1,
     "VALID_MOVE": 0,
@@ -15,17 +25,145 @@ REWARDS = {
 }
 
 
+OBSERVATION_MODES = ["dict", "flat", "key"]
+
+# Action mask of a player without valid moves: any action passes the turn
+ALL_ACTIONS = 0xFFFF
+
+
+@functools.lru_cache(maxsize=None)
+def legal_actions(mask):
+    # The actions in a 16 bit action mask as an array, cached per mask
+    actions = np.flatnonzero((mask >> np.arange(16)) & 1)
+    actions.flags.writeable = False
+    return actions
+
+
+def ids_key(missions, table, hand):
+    # Perfect integer encoding of an observation: mission ids (-1..53), table card
+    # ids (0..27) and hand card ids (-1..27) as digits of a mixed radix number.
+    # The largest key is below 2^63.
+    key = 0
+    for m in missions:
+        key = key * 55 + m + 1
+    for c in table:
+        key = key * 28 + c
+    for c in hand:
+        key = key * 29 + c + 1
+    return int(key)
+
+
+MAX_KEY = ids_key([53] * 4, [27] * 4, [27] * 4)
+
+# With card counting the played counts of Game.played_counts are appended to the
+# key as its lowest bits, which takes the key beyond 64 bits
+PLAYED_KEY_BITS = PLAYED_BITS * NUMBER_OF_FACES
+PLAYED_MASK = (1 << PLAYED_BITS) - 1
+
+
+def played_counts_key(counts):
+    # Packs the played copies of every face the way Game.played_counts does
+    key = 0
+    for face, count in enumerate(counts):
+        key |= int(count) << (PLAYED_BITS * face)
+    return key
+
+
+def played_counts_list(key):
+    return [
+        (key >> (PLAYED_BITS * face)) & PLAYED_MASK for face in range(NUMBER_OF_FACES)
+    ]
+
+
+def observation_key(obs):
+    # Integer key of an observation in any of the observation modes
+    if isinstance(obs, int):
+        return obs
+    if isinstance(obs, np.ndarray):
+        key = ids_key(obs[0:4].tolist(), obs[4:8].tolist(), obs[8:12].tolist())
+        if len(obs) > 12:
+            key = (key << PLAYED_KEY_BITS) | played_counts_key(obs[12:].tolist())
+        return key
+    key = ids_key(obs["current_missions"], obs["table_cards"], obs["player_cards"])
+    if "played_cards" in obs:
+        key = (key << PLAYED_KEY_BITS) | played_counts_key(obs["played_cards"])
+    return key
+
+
+class KeySpace(spaces.Space):
+    # Integer state keys below n of any width, Discrete holds at most 64 bits
+
+    def __init__(self, n, seed=None):
+        super().__init__(shape=(), dtype=None, seed=seed)
+        self.n = n
+
+    @property
+    def is_np_flattenable(self):
+        return False
+
+    def sample(self, mask=None):
+        size = (self.n.bit_length() + 7) // 8
+        return int.from_bytes(self.np_random.bytes(size), "little") % self.n
+
+    def contains(self, x):
+        return isinstance(x, (int, np.integer)) and 0 <= int(x) < self.n
+
+    def __repr__(self):
+        return f"KeySpace({self.n})"
+
+    def __eq__(self, other):
+        return isinstance(other, KeySpace) and self.n == other.n
+
+
 class CahootsEnv(gym.Env):
-    def __init__(self, render_mode, number_of_players, number_of_missions, outdir):
+    def __init__(
+        self,
+        render_mode,
+        number_of_players,
+        number_of_missions,
+        outdir,
+        engine="object",
+        obs_mode="dict",
+        render_process=False,
+        profile=False,
+        card_counting=False,
+        action_mask=False,
+        canonical=False,
+    ):
+        # obs_mode "dict" gives the nested observations described by
+        # observation_space, "flat" the 12 ids as an int16 array and "key"
+        # observation_key as int. The modes step at about the same speed, "key"
+        # saves the agent from computing the key of every observation.
+        # With profile the phases of step are timed by self.profiler, whose
+        # counters are also returned as info["profile"]. With card_counting the
+        # observation also holds the played copies of every face: "played_cards"
+        # in dict mode, 28 more entries in flat mode and PLAYED_KEY_BITS more bits
+        # in key mode (key_words tells the Q-table how wide the keys are). With
+        # action_mask the info of reset and step holds the 16 bit mask of the
+        # valid actions of the player to move as "action_mask" (ALL_ACTIONS if
+        # there are none, then every action passes the turn). With canonical the
+        # observation holds the hand of the player to move (instead of that of the
+        # first player) sorted by face and actions refer to it in sorted order, see
+        # to_env_action; the info then always holds an action mask, which leaves
+        # out the second copy of a face.
         self.render_mode = render_mode
+        self.obs_mode = obs_mode
         self.number_of_missions = number_of_missions
+        self.card_counting = card_counting
+        self.key_words = 2 if card_counting else 1
+        self.action_mask = action_mask
+        self.canonical = canonical
+        self.masks = action_mask or canonical  # Whether the info has action masks
 
         players = []
         for no in range(0, number_of_players):
             players.append(Player(f"Player {no}"))
 
-        self.cahoots = Game(
-            players=players, number_of_missions=self.number_of_missions, outdir=outdir
+        self.cahoots = ENGINES[engine](
+            players=players,
+            number_of_missions=self.number_of_missions,
+            outdir=outdir,
+            render_process=render_process,
         )
 
         self.cahoots.reset()
@@ -34,7 +172,6 @@ class CahootsEnv(gym.Env):
         self.num_cards = len(self.cahoots.allcards) + 1
         self.total_possible_missions = self.cahoots.total_possible_missions + 1
 
-        # FIXME: what about played cards?
         self.observation_space = spaces.Dict(
             {
                 "player_cards": spaces.Tuple(
@@ -64,49 +201,85 @@ class CahootsEnv(gym.Env):
             }
         )
 
+        size = 12
+        if card_counting:
+            self.observation_space["played_cards"] = spaces.Tuple(
+                [spaces.Discrete(3)] * NUMBER_OF_FACES
+            )
+            size += NUMBER_OF_FACES
+
+        if obs_mode == "flat":
+            self.observation_space = spaces.Box(
+                low=-1, high=self.total_possible_missions, shape=(size,), dtype=np.int16
+            )
+        elif obs_mode == "key":
+            if card_counting:
+                self.observation_space = KeySpace((MAX_KEY + 1) << PLAYED_KEY_BITS)
+            else:
+                self.observation_space = spaces.Discrete(MAX_KEY + 1)
+
         self.action_space = spaces.Discrete(16)
 
+        # Seed and initial game state of the last seeded reset. A seeded reset
+        # always deals the same game, so training on a fixed seed deals it once.
+        self.initial_state = None
+
+        self.profiler = None
+        if profile:
+            self.profiler = Profiler()
+            self.profiler.wrap(self.cahoots, "count_moves", "validate")
+            self.profiler.wrap(self.cahoots, "valid_move", "validate")
+            self.profiler.wrap(self.cahoots, "legal_mask", "validate")
+            self.profiler.wrap(self.cahoots, "do_move", "do_move")
+            self.profiler.wrap(self.cahoots, "finish_turn", "finish_turn")
+            self.profiler.wrap(self, "_get_obs", "observation")
+            self.profiler.wrap(self, "render", "render")
+
     def _get_obs(self):
-        obs = self.observation_space.sample()
+        missions = self.cahoots.mission_ids()
+        if len(missions) < 4:
+            missions = missions + [-1] * (4 - len(missions))
+        table = self.cahoots.table_ids()
+        if self.canonical:
+            # The hand the actions refer to
+            hand = sorted(self.cahoots.hand_ids())
+        else:
+            hand = self.cahoots.hand_ids(self.cahoots.players[0])
 
-        t = list(obs["current_missions"])
-        for index, m in enumerate(self.cahoots.missions):
-            if m:
-                val = m.id
-            else:
-                val = -1
-            t[index] = val
-        obs["current_missions"] = tuple(t)
-
-        t = list(obs["table_cards"])
-        for index, c in enumerate(self.cahoots.table_cards):
-            if c:
-                val = c.id
-            else:
-                val = -1
-            t[index] = val
-        obs["table_cards"] = tuple(t)
-
-        t = list(obs["player_cards"])
-        for index, c in enumerate(self.cahoots.players[0].cards):
-            if c:
-                val = c.id
-            else:
-                val = -1
-            t[index] = val
-        obs["player_cards"] = tuple(t)
+        if self.obs_mode == "key":
+            key = ids_key(missions, table, hand)
+            if self.card_counting:
+                key = (key << PLAYED_KEY_BITS) | self.cahoots.played_counts
+            return key
+
+        if self.obs_mode == "flat":
+            ids = missions + table + hand
+            if self.card_counting:
+                ids += played_counts_list(self.cahoots.played_counts)
+            return np.array(ids, dtype=np.int16)
 
+        obs = {
+            "current_missions": tuple(missions),
+            "player_cards": tuple(hand),
+            "table_cards": tuple(table),
+        }
+        if self.card_counting:
+            obs["played_cards"] = tuple(played_counts_list(self.cahoots.played_counts))
         return obs
 
     def action_to_src_dest(self, action):
+        # Plain ints, a NumPy action would turn the packed game state into NumPy
+        # integers that overflow when the card counts are added to the key
         src = int(action / 4)
-        dst = action - int(action / 4) * 4
+        dst = int(action) - src * 4
         return [src, dst]
 
     def step(self, action):
         terminated = False
         solved_mission_count = 0
 
+        if self.canonical:
+            action = self.to_env_action(action)
         [src, dst] = self.action_to_src_dest(action)
 
         reward = 0
@@ -129,10 +302,10 @@ class CahootsEnv(gym.Env):
                 reward += REWARDS["MISSION_ACCOMPLISHED"] * solved_mission_count
 
         # Check for the end conditions of the game
-        state = self.cahoots.get_stats()
-        if state["finished"]:
+        won = self.cahoots.count_remaining_missions() == 0
+        if self.cahoots.finished:
             terminated = True
-            if len(state["missions_remaining"]) == 0:
+            if won:
                 reward += REWARDS["WON_GAME"]
                 # print ("WON!")
             else:
@@ -144,6 +317,19 @@ class CahootsEnv(gym.Env):
         if self.render_mode:
             self.render()
 
+        state = {
+            "missions_total": self.cahoots.number_of_missions,
+            "missions_remaining": self.cahoots.get_remaining_missions(),
+            "missions_solved": list(self.cahoots.solved_missions),
+            "cards_left": len(self.cahoots.allcards),
+            "finished": terminated,
+            "won": won,
+        }
+        if self.profiler:
+            state["profile"] = self.profiler.counters
+        if self.masks:
+            state["action_mask"] = self.legal_mask()
+
         return observation, reward, terminated, False, state
 
     def render(self):
@@ -153,9 +339,53 @@ class CahootsEnv(gym.Env):
         self.render_mode = mode
 
     def reset(self, seed=None, options=None):
-        if seed:
-            random.seed(seed)
+        super().reset(seed=seed)
+        if seed is not None:
+            if self.initial_state and self.initial_state[0] == seed:
+                self.cahoots.restore(self.initial_state[1])
+            else:
+                self.cahoots.rng.seed(seed)
+                self.cahoots.reset()
+                self.initial_state = (seed, self.cahoots.clone())
+        else:
+            self.cahoots.reset()
 
-        self.cahoots.reset()
+        info = {"action_mask": self.legal_mask()} if self.masks else {}
+        return self._get_obs(), info
+
+    def legal_mask(self):
+        # Mask of the actions that step accepts without the invalid move penalty,
+        # all of them without action_mask. Canonical masks are over the canonical
+        # actions and leave out the second copy of a face, which is the same move
+        # as the first.
+        mask = ALL_ACTIONS
+        if self.action_mask:
+            mask = self.cahoots.legal_mask() or ALL_ACTIONS
+        if not self.canonical:
+            return mask
+
+        order, hand = self._hand_order()
+        canonical = 0
+        for i, slot in enumerate(order):
+            if i > 0 and hand[slot] == hand[order[i - 1]]:
+                continue
+            canonical |= ((mask >> (4 * slot)) & 0xF) << (4 * i)
+        return canonical
+
+    def _hand_order(self):
+        # Slots of the hand of the player to move sorted by face, empty slots
+        # first, and the faces of the hand
+        hand = self.cahoots.hand_ids()
+        return sorted(range(0, 4), key=hand.__getitem__), hand
+
+    def to_env_action(self, action):
+        # Canonical action -> action on the hand slots of the player to move
+        order, _ = self._hand_order()
+        return order[action // 4] * 4 + action % 4
 
-        return self._get_obs(), None
+    def to_canonical_action(self, action):
+        # Action on the hand slots of the player to move -> canonical action, both
+        # copies of a face give the action of the first one
+        order, hand = self._hand_order()
+        src = [hand[slot] for slot in order].index(hand[action // 4])
+        return src * 4 + action % 4
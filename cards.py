@@ -29,16 +29,44 @@ class Card:
             return self._colored(text, 33)
 
 
+def _build_compatible():
+    # COMPATIBLE[face] has bit f set if a card with face f may be played on a card
+    # with the given face (faces are the Card ids of CardDeck)
+    faces = [(c, n) for c in Color for n in range(1, 8)]
+    compatible = []
+    for dst_color, dst_number in faces:
+        mask = 0
+        for face, (color, number) in enumerate(faces):
+            if color == dst_color or number == dst_number:
+                mask |= 1 << face
+        compatible.append(mask)
+    return compatible
+
+
+COMPATIBLE = _build_compatible()
+
+
+def _build_cards():
+    # Both copies of every card, ordered by id
+    cards = []
+    id = 0
+    for c in Color:
+        for n in range(1, 8):
+            for i in range(0, 2):
+                cards.append(Card(id, c, n))
+            id += 1
+    return cards
+
+
+# Cards are never modified, so all decks share the same 56 objects
+CARDS = _build_cards()
+
+
 class CardDeck:
-    def __init__(self):
-        self.allcards = []
-        id = 0
-        for c in Color:
-            for n in range(1, 8):
-                for i in range(0, 2):
-                    self.allcards.append(Card(id, c, n))
-                id += 1
-        random.shuffle(self.allcards)
+    def __init__(self, rng=random):
+        # rng is the random.Random (or the random module) used for shuffling
+        self.allcards = list(CARDS)
+        rng.shuffle(self.allcards)
 
     def get_cards(self):
         return self.allcards
@@ -0,0 +1,91 @@
+import json
+import os
+import random
+import shutil
+
+import numpy as np
+
+from qtable import QTable
+
+# A checkpoint is a directory ckpt-<episode> holding the Q-table and statistics as
+# .npy files (memory-mappable, no pickling) and the scalar state in state.json
+
+
+def _checkpoint_name(episode):
+    return f"ckpt-{episode:09d}"
+
+
+def _checkpoints(directory):
+    # Names of the complete checkpoints in the directory, oldest first
+    return sorted(
+        n
+        for n in os.listdir(directory)
+        if n.startswith("ckpt-") and not n.endswith(".tmp")
+    )
+
+
+def latest_checkpoint(directory):
+    # Path of the most recent complete checkpoint in the directory, or None
+    if not os.path.isdir(directory):
+        return None
+    names = _checkpoints(directory)
+    if not names:
+        return None
+    return os.path.join(directory, names[-1])
+
+
+def save_checkpoint(directory, episode, agent, env, stats, keep=2):
+    # Writes a checkpoint for the given number of finished episodes. The data is
+    # written to a temporary directory first, so an interrupted save never shows
+    # up as the latest checkpoint.
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _checkpoint_name(episode))
+    tmp = f"{path}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.mkdir(tmp)
+
+    agent.q_values.save(tmp)
+    for name, values in stats.items():
+        np.save(os.path.join(tmp, f"stats_{name}.npy"), np.asarray(values))
+
+    state = {
+        "episode": episode,
+        "epsilon": agent.epsilon,
+        "random": random.getstate(),
+        "numpy_random": np.random.get_state(legacy=False),
+        "action_space_random": env.action_space.np_random.bit_generator.state,
+        "game_random": env.cahoots.rng.getstate(),
+    }
+    with open(os.path.join(tmp, "state.json"), "w") as f:
+        json.dump(state, f, default=lambda o: o.tolist())
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+
+    # Remove older checkpoints
+    for name in _checkpoints(directory)[0:-keep]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return path
+
+
+def load_checkpoint(path, agent, env):
+    # Restores the agent and the random generators from a checkpoint, returns the
+    # number of finished episodes and the saved statistics
+    with open(os.path.join(path, "state.json")) as f:
+        state = json.load(f)
+
+    agent.q_values = QTable.load(path, agent.initial_value)
+    agent.epsilon = state["epsilon"]
+
+    version, internal, gauss = state["random"]
+    random.setstate((version, tuple(internal), gauss))
+    np.random.set_state(state["numpy_random"])
+    env.action_space.np_random.bit_generator.state = state["action_space_random"]
+    version, internal, gauss = state["game_random"]
+    env.cahoots.rng.setstate((version, tuple(internal), gauss))
+
+    stats = {}
+    for name in os.listdir(path):
+        if name.startswith("stats_"):
+            stats[name[6:-4]] = np.load(os.path.join(path, name), mmap_mode="r")
+    return state["episode"], stats
@@ -0,0 +1,381 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+import players as player_classes
+from agent import Agent
+from cahootsenv import ENGINES, REWARDS, CahootsEnv
+from checkpoint import latest_checkpoint
+from qtable import QTable
+
+# Result of one evaluated game
+GAME_DTYPE = np.dtype(
+    [
+        ("seed", np.int64),
+        ("won", np.bool_),
+        ("solved", np.int16),
+        ("steps", np.int32),
+        ("truncated", np.bool_),
+    ]
+)
+
+_runner = None  # Every worker process builds its game or environment once
+
+
+class BotRunner:
+    # Plays games with every seat taken by the same Player subclass, the way
+    # play.py does. The bots draw their moves from the game's generator, which
+    # is seeded with the game seed once the cards are dealt.
+    def __init__(self, task):
+        player = task["player"]
+        if isinstance(player, str):
+            player = getattr(player_classes, player)
+        kwargs = task["player_kwargs"] or {}
+        self.game = ENGINES[task["engine"]](
+            players=[
+                player(f"Player {no}", **kwargs) for no in range(0, task["players"])
+            ],
+            number_of_missions=task["missions"],
+        )
+
+    def play(self, deal_seed, game_seed, max_steps):
+        g = self.game
+        g.rng.seed(deal_seed)
+        g.reset()
+        g.rng.seed(game_seed)
+        g.finish_turn(first_time=True)
+
+        steps = 0
+        while not g.finished and steps < max_steps:
+            steps += 1
+            if g.count_moves() == 0:
+                g.finish_turn()
+                continue
+            src, dest = g.get_player_action()
+            if not g.valid_move(src, dest):
+                g.finish_turn(valid_move=False)
+            else:
+                g.do_move(src, dest)
+                g.finish_turn()
+        return g, steps
+
+
+class PolicyRunner:
+    # Plays games in CahootsEnv with the greedy policy of a saved Q-table, with
+    # card counting if the table has the wide keys of card counting
+    def __init__(self, task):
+        q_values = QTable.load(task["policy"], task["initial_value"])
+        self.env = CahootsEnv(
+            render_mode=False,
+            number_of_players=task["players"],
+            number_of_missions=task["missions"],
+            outdir=None,
+            engine=task["engine"],
+            obs_mode="key",
+            card_counting=q_values.key_words > 1,
+            action_mask=task["action_mask"],
+            canonical=task["canonical"],
+        )
+        self.agent = Agent(
+            env=self.env,
+            learning_rate=0,
+            initial_epsilon=0,
+            epsilon_decay=0,
+            final_epsilon=0,
+            discount_factor=0,
+            initial_value=task["initial_value"],
+        )
+        self.agent.q_values = q_values
+
+    def play(self, deal_seed, game_seed, max_steps):
+        env = self.env
+        # The same deal as env.reset(seed=deal_seed), without keeping a copy of
+        # the initial state of every seed
+        env.cahoots.rng.seed(deal_seed)
+        random.seed(game_seed)
+        key, info = env.reset()
+        mask = info["action_mask"] if env.masks else None
+
+        steps = 0
+        done = False
+        while not done and steps < max_steps:
+            steps += 1
+            action, _ = self.agent.get_action_for_key(env, key, mask)
+            next_key, reward, done, _, state = env.step(action)
+            if env.masks:
+                mask = state["action_mask"]
+            if next_key == key and reward == REWARDS["INVALID_MOVE"]:
+                # An invalid move leaves the state as it is, with a single best
+                # action the greedy policy would repeat it until max_steps
+                q = self.agent.q_values.get(key)
+                if np.count_nonzero(q == q.max()) == 1:
+                    break
+            key = next_key
+        return env.cahoots, steps
+
+
+def run_games(task):
+    """Plays the games of one chunk of seeds.
+
+    Game i of the chunk is dealt with seed task["seeds"][i] (or task["deal"] if
+    every game uses the same deal) and the players draw their random numbers from
+    a generator seeded with task["seeds"][i]. Returns a GAME_DTYPE array.
+    """
+    global _runner
+    if _runner is None:
+        _runner = PolicyRunner(task) if task["policy"] else BotRunner(task)
+
+    results = np.zeros(len(task["seeds"]), dtype=GAME_DTYPE)
+    for i, seed in enumerate(task["seeds"]):
+        g, steps = _runner.play(task["deal"] or seed, seed, task["max_steps"])
+        results[i] = (
+            seed,
+            g.count_remaining_missions() == 0,
+            len(g.solved_missions),
+            steps,
+            not g.finished,
+        )
+    return results
+
+
+def evaluate(
+    games,
+    player=None,
+    player_kwargs=None,
+    policy=None,
+    initial_value=1000.0,
+    seed=1,
+    same_deal=False,
+    workers=1,
+    players=2,
+    missions=8,
+    engine="bitboard",
+    max_steps=1000,
+    chunk=None,
+    progress=True,
+    action_mask=False,
+    canonical=False,
+):
+    """Plays `games` seeded games with a bot or a greedy Q-policy.
+
+    Either `player` (a Player subclass or the name of one in players.py, which
+    takes every seat) or `policy` (a directory with a saved Q-table, played
+    greedily without exploration, over the valid actions only with action_mask,
+    on sorted hands with canonical) must be given. The games use the seeds seed,
+    seed + 1, ... for the deals, or deal `seed` every time with same_deal. A game
+    that is not over after max_steps steps, or in which the policy keeps repeating
+    the same invalid move, counts as lost. The chunks of games are
+    spread over `workers` forked processes. Returns a GAME_DTYPE array in seed
+    order.
+    """
+    if (player is None) == (policy is None):
+        raise ValueError("Specify either a player or a policy")
+
+    seeds = np.arange(seed, seed + games, dtype=np.int64)
+    if chunk is None:
+        chunk = max(1, min(1000, math.ceil(games / (8 * workers))))
+    tasks = [
+        {
+            "players": players,
+            "missions": missions,
+            "engine": engine,
+            "player": player,
+            "player_kwargs": player_kwargs,
+            "policy": policy,
+            "initial_value": initial_value,
+            "deal": seed if same_deal else None,
+            "seeds": seeds[start : start + chunk].tolist(),
+            "max_steps": max_steps,
+            "action_mask": action_mask,
+            "canonical": canonical,
+        }
+        for start in range(0, games, chunk)
+    ]
+
+    results = []
+    bar = tqdm(total=games, disable=not progress)
+    if workers > 1:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            for result in pool.imap(run_games, tasks):
+                results.append(result)
+                bar.update(len(result))
+    else:
+        global _runner
+        _runner = None
+        for task in tasks:
+            results.append(run_games(task))
+            bar.update(len(results[-1]))
+        _runner = None
+    bar.close()
+    return np.concatenate(results) if results else np.zeros(0, dtype=GAME_DTYPE)
+
+
+def wilson_interval(successes, n, z=1.96):
+    # Confidence interval of a success rate, also sound for rates near 0 or 1
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def mean_interval(values, z=1.96):
+    # Mean and the half width of its normal confidence interval
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        return float(values.mean()) if len(values) else 0.0, 0.0
+    return float(values.mean()), z * float(values.std(ddof=1)) / math.sqrt(len(values))
+
+
+def summary(results, seconds=None):
+    # Win rate with its 95% confidence interval, missions solved and steps per game
+    n = len(results)
+    wins = int(results["won"].sum())
+    low, high = wilson_interval(wins, n)
+    solved, solved_ci = mean_interval(results["solved"])
+    steps, steps_ci = mean_interval(results["steps"])
+    report = {
+        "games": n,
+        "wins": wins,
+        "win_rate": wins / n if n else 0.0,
+        "win_rate_low": low,
+        "win_rate_high": high,
+        "missions_solved": solved,
+        "missions_solved_ci": solved_ci,
+        "steps": steps,
+        "steps_ci": steps_ci,
+        "truncated": int(results["truncated"].sum()),
+    }
+    if seconds is not None:
+        report["seconds"] = seconds
+        report["games_per_sec"] = n / seconds if seconds else 0.0
+    return report
+
+
+def format_summary(report):
+    lines = [
+        f"Games           : {report['games']}",
+        f"Win rate        : {100 * report['win_rate']:.2f}% "
+        f"(95% CI {100 * report['win_rate_low']:.2f}% - "
+        f"{100 * report['win_rate_high']:.2f}%)",
+        f"Missions solved : {report['missions_solved']:.3f} "
+        f"± {report['missions_solved_ci']:.3f}",
+        f"Steps per game  : {report['steps']:.1f} ± {report['steps_ci']:.1f}",
+    ]
+    if report["truncated"]:
+        lines.append(f"Truncated       : {report['truncated']}")
+    if "seconds" in report:
+        lines.append(
+            f"Time            : {report['seconds']:.1f} s "
+            f"({report['games_per_sec']:.0f} games/s)"
+        )
+    return "\n".join(lines)
+
+
+def policy_directory(path):
+    # Directory of a saved Q-table: a policy or checkpoint directory, or the
+    # latest checkpoint of a --checkpoint-dir
+    if os.path.exists(os.path.join(path, "q_keys.npy")):
+        return path
+    latest = latest_checkpoint(path)
+    if latest is None:
+        raise ValueError(f"No Q-table found in '{path}'")
+    return latest
+
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    description="Evaluates a bot or a trained greedy Q-policy on many seeded deals",
+)
+policy_group = parser.add_mutually_exclusive_group(required=True)
+policy_group.add_argument(
+    "--player", help="Player subclass from players.py that takes every seat"
+)
+policy_group.add_argument(
+    "--policy",
+    help="Saved Q-table: policy or checkpoint directory, or a --checkpoint-dir",
+)
+parser.add_argument(
+    "--player-kwargs",
+    help="Keyword arguments of the player as JSON, e.g. '{\"iterations\": 100}'",
+    default=None,
+    type=json.loads,
+)
+parser.add_argument(
+    "--initial", help="Q-value of unseen states", default=1000.0, type=float
+)
+parser.add_argument(
+    "--action-mask",
+    help="Let the policy choose among the valid actions only",
+    action="store_true",
+)
+parser.add_argument(
+    "--canonical",
+    help="The policy was trained with train.py --canonical",
+    action="store_true",
+)
+parser.add_argument("--games", help="Number of games", default=10000, type=int)
+parser.add_argument("--seed", help="Seed of the first deal", default=1, type=int)
+parser.add_argument(
+    "--same-deal",
+    help="Play every game on the deal of --seed, as train.py does with a fixed seed",
+    action="store_true",
+)
+parser.add_argument("--workers", help="Number of worker processes", default=1, type=int)
+parser.add_argument(
+    "--max-steps",
+    help="Steps after which an unfinished game counts as lost",
+    default=1000,
+    type=int,
+)
+parser.add_argument("--missions", help="Number of missions", default=8, type=int)
+parser.add_argument("--players", help="Number of players", default=2, type=int)
+parser.add_argument(
+    "--engine", help="Game engine", default="bitboard", choices=list(ENGINES)
+)
+parser.add_argument("--save", help="Write the summary as JSON to this file")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    player = None
+    if args.player:
+        player = getattr(player_classes, args.player, None)
+        if not (
+            isinstance(player, type)
+            and issubclass(player, player_classes.Player)
+            and player is not player_classes.Player
+        ):
+            parser.error(f"'{args.player}' is not a bot in players.py")
+
+    start = time.perf_counter()
+    results = evaluate(
+        args.games,
+        player=player,
+        player_kwargs=args.player_kwargs,
+        policy=policy_directory(args.policy) if args.policy else None,
+        initial_value=args.initial,
+        seed=args.seed,
+        same_deal=args.same_deal,
+        workers=args.workers,
+        players=args.players,
+        missions=args.missions,
+        engine=args.engine,
+        max_steps=args.max_steps,
+        action_mask=args.action_mask,
+        canonical=args.canonical,
+    )
+    report = summary(results, time.perf_counter() - start)
+    print(format_summary(report))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,154 @@
+import math
+import multiprocessing
+import random
+import time
+
+PASS = None  # Move of a player without valid moves
+
+
+class Node:
+    __slots__ = ["children", "visits", "value", "available"]
+
+    def __init__(self):
+        self.children = {}  # Move -> Node
+        self.visits = 0
+        self.value = 0.0  # Sum of the rewards of the iterations through the node
+        self.available = 0  # Iterations in which the move was valid
+
+
+def legal_moves(g):
+    if g.count_moves() == 0:
+        return [PASS]
+    return [
+        (src, dest)
+        for src in range(0, 4)
+        for dest in range(0, 4)
+        if g.valid_move(src, dest)
+    ]
+
+
+def play(g, move):
+    # Plays a move the way play.py does, returns the number of solved missions.
+    # finish_turn counts the passes that solved something, one pass can solve
+    # several missions.
+    before = len(g.solved_missions)
+    if move is not PASS:
+        g.do_move(*move)
+    g.finish_turn()
+    return len(g.solved_missions) - before
+
+
+def rollout(g, rng, depth=None):
+    # Random valid moves until the game ends or depth moves are played
+    solved = 0
+    moves = 0
+    while not g.finished and (depth is None or moves < depth):
+        solved += play(g, rng.choice(legal_moves(g)))
+        moves += 1
+    return solved
+
+
+def search(game, rng, iterations=None, seconds=None, exploration=0.7, depth=None):
+    """Information set MCTS from the point of view of the current player.
+
+    Every iteration samples the hidden cards and missions (Game.sample_hidden) on a
+    clone, walks down the tree with UCB among the moves that are valid in that
+    sample, adds one node and finishes the game with a random rollout. The reward
+    is the fraction of the remaining missions that got solved; the players play
+    together, so every player maximizes the same reward. Stops after `iterations`
+    iterations or `seconds` seconds, whichever comes first. Returns the root.
+    """
+    if iterations is None and not seconds:
+        raise ValueError("Specify iterations and/or seconds")
+    root = Node()
+    remaining = max(1, game.count_remaining_missions())
+    deadline = time.perf_counter() + seconds if seconds else None
+
+    while True:
+        if iterations is not None and root.visits >= iterations:
+            break
+        if deadline and time.perf_counter() > deadline:
+            break
+
+        g = game.clone()
+        g.sample_hidden(rng)
+
+        node = root
+        path = [root]
+        solved = 0
+        while not g.finished:
+            moves = legal_moves(g)
+            untried = [m for m in moves if m not in node.children]
+            if untried:
+                move = rng.choice(untried)
+                node.children[move] = Node()
+                for m in moves:
+                    if m in node.children:
+                        node.children[m].available += 1
+                node = node.children[move]
+                path.append(node)
+                solved += play(g, move)
+                break
+
+            best = None
+            best_score = -1
+            for m in moves:
+                child = node.children[m]
+                child.available += 1
+                score = child.value / child.visits + exploration * math.sqrt(
+                    math.log(child.available) / child.visits
+                )
+                if score > best_score:
+                    best = m
+                    best_score = score
+            node = node.children[best]
+            path.append(node)
+            solved += play(g, best)
+
+        solved += rollout(g, rng, depth)
+
+        reward = solved / remaining
+        for node in path:
+            node.visits += 1
+            node.value += reward
+
+    return root
+
+
+_game = None  # The game of a root-parallel search, inherited by the forked workers
+
+
+def _search_worker(task):
+    seed, iterations, seconds, exploration, depth = task
+    root = search(_game, random.Random(seed), iterations, seconds, exploration, depth)
+    stats = {m: (c.visits, c.value) for m, c in root.children.items()}
+    return stats, root.visits
+
+
+def parallel_search(
+    game, seed, workers, iterations=None, seconds=None, exploration=0.7, depth=None
+):
+    # Root-parallel MCTS: every worker process builds its own tree from its own
+    # samples, the visits and values of the root moves are summed. Returns the
+    # merged {move: (visits, value)} and the total number of rollouts.
+    if iterations is None and not seconds:
+        raise ValueError("Specify iterations and/or seconds")
+    global _game
+    _game = game
+    per_worker = None if iterations is None else -(-iterations // workers)
+    tasks = [
+        (seed + worker, per_worker, seconds, exploration, depth)
+        for worker in range(0, workers)
+    ]
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        results = pool.map(_search_worker, tasks)
+    _game = None
+
+    merged = {}
+    rollouts = 0
+    for stats, visits in results:
+        rollouts += visits
+        for move, (v, value) in stats.items():
+            total = merged.get(move, (0, 0.0))
+            merged[move] = (total[0] + v, total[1] + value)
+    return merged, rollouts
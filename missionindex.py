@@ -0,0 +1,225 @@
+import hashlib
+import itertools
+import mmap
+import os
+
+import numpy as np
+
+from cards import Card
+from colors import Color
+from missions import create_missions
+
+# A table is encoded by the faces (Card.id, 0..27) of its four cards, so there are
+# only 28^4 different tables. For every mission we store one bit per table telling
+# whether the mission is solved on that table.
+NUMBER_OF_FACES = 28
+NUMBER_OF_TABLES = NUMBER_OF_FACES**4
+STRIDE = NUMBER_OF_TABLES // 8  # Bytes per mission bitset
+
+DEFAULT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def table_key(ids):
+    # Encodes the faces of the four table cards as a single integer
+    return ((ids[0] * 28 + ids[1]) * 28 + ids[2]) * 28 + ids[3]
+
+
+def _catalog_digest(missions):
+    # The cache is rebuilt whenever the mission catalog changes
+    text = "\n".join(f"{type(m).__qualname__}:{m}" for m in missions)
+    return hashlib.sha1(text.encode()).hexdigest()[0:12]
+
+
+def build(missions):
+    # Evaluates every mission on every possible table, returns the packed bitsets
+    faces = []
+    for color in Color:
+        for number in range(1, 8):
+            faces.append(Card(len(faces), color, number))
+
+    tables = [list(t) for t in itertools.product(faces, repeat=4)]
+    result = np.zeros((len(missions), STRIDE), dtype=np.uint8)
+    for m, mission in enumerate(missions):
+        bits = np.fromiter(
+            (mission.test(t) for t in tables), dtype=bool, count=NUMBER_OF_TABLES
+        )
+        result[m] = np.packbits(bits, bitorder="little")
+    return result
+
+
+def build_requirements(bits):
+    # The cards needed for every table on which a mission is solved, given its
+    # unpacked truth table: a mask of the faces needed at least once and a mask of
+    # the faces needed twice. Tables with three cards of one face are left out, as
+    # there are only two copies of every card.
+    keys = np.flatnonzero(bits)
+    faces = np.stack(
+        [keys // 28**3, keys // 28**2 % 28, keys // 28 % 28, keys % 28], axis=1
+    )
+    faces.sort(axis=1)
+    a, b, c, d = faces.T
+    possible = ~((a == b) & (b == c)) & ~((b == c) & (c == d))
+    one = np.int64(1)
+    once = (one << a) | (one << b) | (one << c) | (one << d)
+    twice = (
+        np.where(a == b, one << a, 0)
+        | np.where(b == c, one << b, 0)
+        | np.where(c == d, one << c, 0)
+    )
+    needs = np.unique(np.stack([once, twice], axis=1)[possible], axis=0)
+    return needs[:, 0], needs[:, 1]
+
+
+def build_depends(bits):
+    # For every mission, position and pair of faces (a, b): whether replacing a
+    # by b on that position can change the outcome of the mission for any
+    # combination of the other three cards
+    truth = np.unpackbits(bits, axis=1, bitorder="little").reshape(
+        (len(bits),) + (NUMBER_OF_FACES,) * 4
+    )
+    result = np.zeros((len(bits), 4, NUMBER_OF_FACES, NUMBER_OF_FACES), dtype=np.uint8)
+    for m in range(len(bits)):
+        for pos in range(0, 4):
+            rows = np.packbits(
+                np.moveaxis(truth[m], pos, 0).reshape(NUMBER_OF_FACES, -1), axis=1
+            )
+            result[m, pos] = (rows[:, None, :] != rows[None, :, :]).any(axis=2)
+    return result
+
+
+def build_completes(bits):
+    # For every mission, position and combination of the three other faces: the
+    # mask of the faces that solve the mission when put on that position
+    truth = np.unpackbits(bits, axis=1, bitorder="little").reshape(
+        (len(bits),) + (NUMBER_OF_FACES,) * 4
+    )
+    weights = 1 << np.arange(NUMBER_OF_FACES, dtype=np.uint32)
+    result = np.zeros((len(bits), 4, NUMBER_OF_FACES**3), dtype=np.uint32)
+    for m in range(len(bits)):
+        for pos in range(0, 4):
+            rows = np.moveaxis(truth[m], pos, -1).reshape(-1, NUMBER_OF_FACES)
+            result[m, pos] = rows.astype(np.uint32) @ weights
+    return result
+
+
+class MissionIndex:
+    """Precomputed truth table of all missions over all possible tables.
+
+    The bitsets are cached on disk and memory-mapped, so testing a mission is a
+    single byte lookup instead of a Python predicate call. Next to it a small table
+    tells which card changes can affect which mission, so games can skip missions
+    that are known to be unsolved on the table, and a lookahead table tells which
+    cards complete a mission on every position of a table.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR):
+        missions = create_missions()
+        self.path = os.path.join(
+            directory, f"mission_index-{_catalog_digest(missions)}.bin"
+        )
+
+        if not os.path.exists(self.path):
+            print(f"Building mission index {self.path}, this takes a while...")
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            build(missions).tofile(tmp)
+            os.replace(tmp, self.path)
+
+        with open(self.path, "rb") as f:
+            self.bits = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert len(self.bits) == len(missions) * STRIDE
+
+        depends_path = self.path.replace(".bin", "-depends.bin")
+        if not os.path.exists(depends_path):
+            bits = np.frombuffer(self.bits, dtype=np.uint8).reshape(
+                len(missions), STRIDE
+            )
+            tmp = f"{depends_path}.{os.getpid()}.tmp"
+            build_depends(bits).tofile(tmp)
+            os.replace(tmp, depends_path)
+
+        # One bitmask over the new face per (mission, position, old face)
+        depends = np.fromfile(depends_path, dtype=np.uint8).reshape(-1, NUMBER_OF_FACES)
+        weights = 1 << np.arange(NUMBER_OF_FACES, dtype=np.int64)
+        self.depends_masks = (depends.astype(np.int64) @ weights).tolist()
+
+        # Mask of the completing faces per (mission, position, other three faces),
+        # read as 32 bit words straight from the memory-mapped file
+        completes_path = self.path.replace(".bin", "-completes.bin")
+        if not os.path.exists(completes_path):
+            bits = np.frombuffer(self.bits, dtype=np.uint8).reshape(
+                len(missions), STRIDE
+            )
+            tmp = f"{completes_path}.{os.getpid()}.tmp"
+            build_completes(bits).tofile(tmp)
+            os.replace(tmp, completes_path)
+        with open(completes_path, "rb") as f:
+            self.completes_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.completes = memoryview(self.completes_map).cast("I")
+        assert len(self.completes) == len(missions) * 4 * NUMBER_OF_FACES**3
+
+        self.requirements = {}  # Mission id -> build_requirements, built on demand
+        self.witness = {}  # Mission id -> (once, twice) of the last possible table
+        self.impossible = {}  # Mission id -> last (once, twice) without any table
+
+    def test(self, mission_id, key):
+        # Whether the mission is solved on the table with the given key
+        return (self.bits[mission_id * STRIDE + (key >> 3)] >> (key & 7)) & 1 == 1
+
+    def possible(self, mission_id, once, twice):
+        # Whether the mission has a table that can be built from the available
+        # cards: the faces in the mask once are available at least once, those in
+        # twice both times. Card positions and the play rules are ignored, so a
+        # False answer proves that the mission can no longer be solved.
+        need_once, need_twice = self.witness.get(mission_id, (-1, -1))
+        if need_once & ~once == 0 and need_twice & ~twice == 0:
+            return True
+        # Fewer cards than in a known hopeless case are just as hopeless
+        none_once, none_twice = self.impossible.get(mission_id, (0, 0))
+        if once & ~none_once == 0 and twice & ~none_twice == 0:
+            return False
+
+        if mission_id not in self.requirements:
+            bits = np.frombuffer(
+                self.bits, dtype=np.uint8, count=STRIDE, offset=mission_id * STRIDE
+            )
+            self.requirements[mission_id] = build_requirements(
+                np.unpackbits(bits, bitorder="little")
+            )
+        need_once, need_twice = self.requirements[mission_id]
+        hits = np.flatnonzero(((need_once & ~once) | (need_twice & ~twice)) == 0)
+        if len(hits) == 0:
+            self.impossible[mission_id] = (once, twice)
+            return False
+        self.witness[mission_id] = (int(need_once[hits[0]]), int(need_twice[hits[0]]))
+        return True
+
+    def completing_faces(self, mission_id, ids):
+        # The faces that solve the mission when put on each position of the table
+        # with the given faces, as four masks over the faces
+        a, b, c, d = ids
+        base = mission_id * 4 * NUMBER_OF_FACES**3
+        size = NUMBER_OF_FACES**3
+        completes = self.completes
+        return [
+            completes[base + (b * 28 + c) * 28 + d],
+            completes[base + size + (a * 28 + c) * 28 + d],
+            completes[base + 2 * size + (a * 28 + b) * 28 + d],
+            completes[base + 3 * size + (a * 28 + b) * 28 + c],
+        ]
+
+    def depends(self, mission_id, pos, old, new):
+        # Whether replacing face old by face new on position pos can change the
+        # outcome of the mission
+        row = self.depends_masks[(mission_id * 4 + pos) * NUMBER_OF_FACES + old]
+        return (row >> new) & 1 == 1
+
+
+_index = None
+
+
+def get_mission_index():
+    # The index is loaded on first use and shared by all games in the process
+    global _index
+    if _index is None:
+        _index = MissionIndex()
+    return _index
@@ -44,13 +44,10 @@ def get_colors(cards):
 
 
 class MissionDeck:
-    def __init__(self):
-        self.allmissions = create_missions()
-        id = 0
-        for m in self.allmissions:
-            m.id = id
-            id += 1
-        random.shuffle(self.allmissions)
+    def __init__(self, rng=random):
+        # rng is the random.Random (or the random module) used for shuffling
+        self.allmissions = list(MISSIONS)
+        rng.shuffle(self.allmissions)
 
     def get_missions(self, n):
         return self.allmissions[0:n]
@@ -438,3 +435,9 @@ def create_missions():
 
     assert len(missions) == 54
     return missions
+
+
+# The missions are stateless, so all decks and games share one catalog
+MISSIONS = create_missions()
+for id, m in enumerate(MISSIONS):
+    m.id = id
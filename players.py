@@ -1,5 +1,8 @@
 import random
-import copy
+import time
+
+from mcts import PASS, parallel_search, search
+from missionindex import get_mission_index
 
 
 class Player:
@@ -39,68 +42,115 @@ class Player:
 
 class Dummy(Player):
     def get_move(self, g):
-        return [random.randint(0, 3), random.randint(0, 3)]
+        return [g.rng.randint(0, 3), g.rng.randint(0, 3)]
 
 
 class MissionMinded(Player):
-    def _backup_state(self, g):
-        self.players = copy.deepcopy(g.players)
-        self.allcards = copy.deepcopy(g.allcards)
-        self.missions = copy.deepcopy(g.missions)
-        self.solved_missions = copy.deepcopy(g.solved_missions)
-        self.table_cards = copy.deepcopy(g.table_cards)
-        self.played_cards = copy.deepcopy(g.played_cards)
-
-        self.finished = copy.deepcopy(g.finished)
-        self.turn = copy.deepcopy(g.turn)
-
-    def _restore_state(self, g):
-        g.players = copy.deepcopy(self.players)
-        g.allcards = copy.deepcopy(self.allcards)
-        g.missions = copy.deepcopy(self.missions)
-        g.solved_missions = copy.deepcopy(self.solved_missions)
-        g.table_cards = copy.deepcopy(self.table_cards)
-        g.played_cards = copy.deepcopy(self.played_cards)
-
-        g.finished = copy.deepcopy(self.finished)
-        g.turn = copy.deepcopy(self.turn)
-
+    # Plays a move that solves the most of the open missions right away, a random
+    # valid move if none does. The moves are ranked with the lookahead table of
+    # the mission index, so the game state is never touched.
     def get_move(self, g):
-        valid_moves = []
-        best_move = None
-
-        ## Bakcup state
-        self._backup_state(g)
+        index = get_mission_index()
+        table = g.table_ids()
+        hand = g.hand_ids()
+
+        # Per position: the mask of completing faces of every open mission
+        completing = [[], [], [], []]
+        for mission_id in g.mission_ids():
+            if mission_id < 0:
+                continue
+            for dest, mask in enumerate(index.completing_faces(mission_id, table)):
+                completing[dest].append(mask)
 
-        # Restore state
-
-        last_count = -1
+        valid_moves = []
+        best_moves = []
+        best_count = 1  # Moves that solve no mission are no better than random
         for src in range(0, 4):
             for dest in range(0, 4):
-                # Copy the current state of the game
-
-                self._restore_state(g)
-
                 if not g.valid_move(src, dest):
-                    print(f"Invalid move {src} -> {dest}")
                     continue
-                print(f"Trying move {src} -> {dest}")
-
                 valid_moves.append([src, dest])
 
-                g.do_move(src, dest)
-
-                count = g.finish_turn()
-
-                if count > last_count:
-                    best_move = [src, dest]
+                count = 0
+                for mask in completing[dest]:
+                    count += (mask >> hand[src]) & 1
+                if count > best_count:
+                    best_count = count
+                    best_moves = []
+                if count == best_count:
+                    best_moves.append([src, dest])
+
+        if best_moves:
+            return g.rng.choice(best_moves)
+        return g.rng.choice(valid_moves)
+
+
+class MCTSPlayer(Player):
+    """Monte Carlo tree search over samples of the hidden cards, see mcts.search.
+
+    Searches for `seconds` seconds and/or `iterations` iterations per move. With
+    more than one worker the search runs root-parallel in forked processes. The
+    samples are drawn from the game's generator, like the other bots, unless a
+    seed gives the player a generator of its own. The rollouts and rollouts/sec
+    of the last move are kept in `stats`.
+    """
+
+    def __init__(
+        self,
+        player,
+        seconds=1.0,
+        iterations=None,
+        workers=1,
+        exploration=0.7,
+        depth=None,
+        seed=None,
+    ):
+        super().__init__(player)
+        self.seconds = seconds
+        self.iterations = iterations
+        self.workers = workers
+        self.exploration = exploration
+        self.depth = depth  # Maximum rollout length, None plays to the end
+        self.rng = random.Random(seed) if seed is not None else None
+        self.stats = {}
 
-                last_count = count
-
-                print(f"{src}->{dest} would sovle {count} missions")
-
-        self._restore_state(g)
-        if best_move:
-            print(f"Playing: {best_move}")
-            return best_move
-        return random.choice(valid_moves)
+    def get_move(self, g):
+        rng = self.rng or g.rng
+        start = time.perf_counter()
+        if self.workers > 1:
+            children, rollouts = parallel_search(
+                g,
+                rng.randrange(2**32),
+                self.workers,
+                self.iterations,
+                self.seconds,
+                self.exploration,
+                self.depth,
+            )
+        else:
+            root = search(
+                g,
+                rng,
+                self.iterations,
+                self.seconds,
+                self.exploration,
+                self.depth,
+            )
+            children = {m: (c.visits, c.value) for m, c in root.children.items()}
+            rollouts = root.visits
+        elapsed = time.perf_counter() - start
+
+        # The most visited move is the most robust choice
+        move = max(children, key=lambda m: children[m][0])
+        visits, value = children[move]
+        self.stats = {
+            "rollouts": rollouts,
+            "seconds": elapsed,
+            "rollouts_per_sec": rollouts / elapsed,
+            "value": value / visits,
+        }
+        if move is PASS:
+            # Any move will do, the game loops pass the turn of a player without
+            # valid moves before asking for one
+            return [0, 0]
+        return list(move)
@@ -0,0 +1,140 @@
+import os
+import sys
+
+import numpy as np
+
+# Keys wider than an int64 (e.g. with card counting) are stored as several
+# non-negative int64 words of KEY_WORD_BITS bits, least significant word first
+KEY_WORD_BITS = 63
+KEY_WORD_MASK = (1 << KEY_WORD_BITS) - 1
+
+INITIAL_CAPACITY = 1024  # Rows allocated for a new or empty table
+
+
+def split_key(key, words):
+    return [(key >> (KEY_WORD_BITS * w)) & KEY_WORD_MASK for w in range(0, words)]
+
+
+def join_key(words):
+    key = 0
+    for w, word in enumerate(words):
+        key |= word << (KEY_WORD_BITS * w)
+    return key
+
+
+class QTable:
+    """Q-values of integer state keys stored as float32 rows of one dense array.
+
+    A dict maps every state key to its row, the keys themselves are also kept in an
+    int64 array so the table can be saved without the dict. Keys of more than 63
+    bits need key_words > 1 words per key, see split_key. Looking up an unseen
+    state does not create a row: the row is only added when it is written.
+    """
+
+    def __init__(
+        self, n_actions, initial_value, capacity=INITIAL_CAPACITY, key_words=1
+    ):
+        self.n_actions = n_actions
+        self.initial_value = initial_value
+        self.key_words = key_words
+
+        self.index = {}  # State key -> row
+        shape = (capacity,) if key_words == 1 else (capacity, key_words)
+        self.keys = np.zeros(shape, dtype=np.int64)
+        self.values = np.zeros((capacity, n_actions), dtype=np.float32)
+
+        # Returned for unseen states, never written to
+        self.default = np.full(n_actions, initial_value, dtype=np.float32)
+        self.default.flags.writeable = False
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key):
+        # Q-values of a state, the initial values if the state was never written
+        i = self.index.get(key)
+        if i is None:
+            return self.default
+        return self.values[i]
+
+    def row(self, key):
+        # Writable Q-values of a state, added on first use
+        i = self._add(key)
+        return self.values[i]
+
+    def _add(self, key):
+        # Row index of a state, added on first use
+        i = self.index.get(key)
+        if i is None:
+            i = len(self.index)
+            if i == len(self.keys):
+                self._grow()
+            self.index[key] = i
+            if self.key_words == 1:
+                self.keys[i] = key
+            else:
+                self.keys[i] = split_key(key, self.key_words)
+            self.values[i] = self.initial_value
+        return i
+
+    def get_many(self, keys):
+        # Q-values of a batch of states as a new (n, n_actions) array, the initial
+        # values for states that were never written
+        index = self.index
+        rows = np.fromiter(
+            (index.get(key, -1) for key in keys), dtype=np.int64, count=len(keys)
+        )
+        q = self.values[rows]
+        q[rows < 0] = self.default
+        return q
+
+    def rows(self, keys):
+        # Row indices of a batch of states, added on first use
+        add = self._add
+        return np.fromiter((add(key) for key in keys), dtype=np.int64, count=len(keys))
+
+    def _grow(self):
+        capacity = max(2 * len(self.keys), INITIAL_CAPACITY)
+        keys = np.zeros((capacity,) + self.keys.shape[1:], dtype=np.int64)
+        keys[0 : len(self.keys)] = self.keys
+        values = np.zeros((capacity, self.n_actions), dtype=np.float32)
+        values[0 : len(self.values)] = self.values
+        self.keys = keys
+        self.values = values
+
+    def nbytes(self):
+        # Memory used by the table, including the dict and its key objects
+        size = self.keys.nbytes + self.values.nbytes + sys.getsizeof(self.index)
+        size += sum(sys.getsizeof(key) for key in self.index)
+        return size
+
+    def bytes_per_state(self):
+        return self.nbytes() / max(1, len(self))
+
+    def save(self, directory):
+        # Writes the used part of the table as .npy files that can be memory-mapped
+        n = len(self)
+        np.save(os.path.join(directory, "q_keys.npy"), self.keys[0:n])
+        np.save(os.path.join(directory, "q_values.npy"), self.values[0:n])
+
+    @classmethod
+    def load(cls, directory, initial_value):
+        # Memory-maps a saved table copy-on-write, so loading does not read the
+        # values and updates never touch the file
+        keys = np.load(os.path.join(directory, "q_keys.npy"), mmap_mode="c")
+        values = np.load(os.path.join(directory, "q_values.npy"), mmap_mode="c")
+
+        key_words = 1 if keys.ndim == 1 else keys.shape[1]
+        table = cls(values.shape[1], initial_value, capacity=1, key_words=key_words)
+        table.keys = keys
+        table.values = values
+        if key_words == 1:
+            table.index = dict(zip(keys.tolist(), range(len(keys))))
+        else:
+            table.index = {join_key(words): i for i, words in enumerate(keys.tolist())}
+        if len(keys) == 0:
+            table._grow()
+        return table
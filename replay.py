@@ -0,0 +1,74 @@
+import numpy as np
+
+from cahootsenv import ALL_ACTIONS
+
+# One transition, as stored in the replay buffer and sent from an actor to the
+# learner
+TRANSITION_DTYPE = np.dtype(
+    [
+        ("key", np.int64),
+        ("action", np.uint8),
+        ("reward", np.int32),
+        ("next_key", np.int64),
+        ("done", np.bool_),
+        ("next_mask", np.uint16),  # Valid actions after the transition
+    ]
+)
+
+# With card counting the state keys do not fit into an int64, they are kept as
+# Python ints
+WIDE_TRANSITION_DTYPE = np.dtype(
+    [
+        ("key", object),
+        ("action", np.uint8),
+        ("reward", np.int32),
+        ("next_key", object),
+        ("done", np.bool_),
+        ("next_mask", np.uint16),
+    ]
+)
+
+
+class ReplayBuffer:
+    """The last `capacity` transitions in one preallocated structured array.
+
+    New transitions overwrite the oldest ones, so the memory use is fixed. Samples
+    are drawn uniformly with the buffer's own generator, so sampling does not
+    disturb the other random streams.
+    """
+
+    def __init__(self, capacity, key_words=1, seed=0):
+        dtype = TRANSITION_DTYPE if key_words == 1 else WIDE_TRANSITION_DTYPE
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+        self.pos = 0  # Where the next transition is written
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key, action, reward, next_key, done, next_mask=ALL_ACTIONS):
+        self.data[self.pos] = (key, action, reward, next_key, done, next_mask)
+        self.pos = (self.pos + 1) % len(self.data)
+        self.size = min(self.size + 1, len(self.data))
+
+    def add_many(self, transitions):
+        # Adds a TRANSITION_DTYPE array, of which only the last capacity are kept
+        transitions = transitions[-len(self.data) :]
+        n = len(transitions)
+        end = self.pos + n
+        if end <= len(self.data):
+            self.data[self.pos : end] = transitions
+        else:
+            first = len(self.data) - self.pos
+            self.data[self.pos :] = transitions[0:first]
+            self.data[0 : n - first] = transitions[first:]
+        self.pos = end % len(self.data)
+        self.size = min(self.size + n, len(self.data))
+
+    def sample(self, n):
+        # n transitions drawn with replacement
+        return self.data[self.rng.integers(0, self.size, n)]
+
+    def nbytes(self):
+        return self.data.nbytes
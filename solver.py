@@ -0,0 +1,316 @@
+import argparse
+import random
+import time
+
+from cahootsenv import ENGINES
+from missionindex import NUMBER_OF_FACES, get_mission_index, table_key
+from players import Player
+
+PASS = None  # Move of a player without valid moves, the turn goes to the next one
+
+
+class SearchLimit(Exception):
+    pass
+
+
+class SearchDone(Exception):
+    pass
+
+
+class Solver:
+    """Exhaustive search of a deal with known deck and mission order.
+
+    The value of a state is the number of missions that can still be solved from
+    it. States are hashed canonically (hand order, card copies and mission slots do
+    not matter, hands are rotated so the current player comes first) into a
+    transposition table. Branches are cut off with an upper bound: the remaining
+    missions minus those that can no longer be built from the cards that have not
+    been covered yet (MissionIndex.possible).
+    """
+
+    def __init__(self, game, max_seconds=None, max_nodes=None):
+        self.game = game
+        self.max_seconds = max_seconds
+        self.max_nodes = max_nodes
+        self.index = get_mission_index()
+
+        # Canonical state -> (value, exact, best move). A value that is not exact
+        # is an upper bound.
+        self.table = {}
+        self.path = []  # Moves played by the search, with the covered face
+        self.nodes = 0
+
+        # Copies of every face that are not covered, and the masks of the faces
+        # available at least once and twice
+        self.available = [2] * NUMBER_OF_FACES
+        for face in game.played_ids():
+            self.available[face] -= 1
+        self.once = 0
+        self.twice = 0
+        for face, count in enumerate(self.available):
+            if count >= 1:
+                self.once |= 1 << face
+            if count == 2:
+                self.twice |= 1 << face
+
+    def key(self):
+        g = self.game
+        players = len(g.players)
+        hands = tuple(
+            tuple(sorted(g.hand_ids(g.players[(g.turn + i) % players])))
+            for i in range(0, players)
+        )
+        return (
+            len(g.allcards),
+            tuple(g.table_ids()),
+            hands,
+            tuple(sorted(g.mission_ids())),
+            len(g.allmissions),
+        )
+
+    def bound(self):
+        # Upper bound of the missions that can still be solved
+        g = self.game
+        possible = self.index.possible
+        count = 0
+        for mission in g.missions:
+            if mission and possible(mission.id, self.once, self.twice):
+                count += 1
+        for mission in g.allmissions:
+            if possible(mission.id, self.once, self.twice):
+                count += 1
+        return count
+
+    def moves(self):
+        # Valid moves of the current player, one per distinct hand card face, as
+        # the two copies of a face lead to the same state
+        g = self.game
+        if g.count_moves() == 0:
+            return [PASS]
+        result = []
+        seen = set()
+        hand = g.hand_ids()
+        for src in range(0, 4):
+            if hand[src] < 0 or hand[src] in seen:
+                continue
+            seen.add(hand[src])
+            for dest in range(0, 4):
+                if g.valid_move(src, dest):
+                    result.append((src, dest))
+        return result
+
+    def ordered_moves(self):
+        # Moves that solve one of the current missions right away come first
+        moves = self.moves()
+        if moves[0] is PASS:
+            return moves
+        g = self.game
+        table = g.table_ids()
+        hand = g.hand_ids()
+        missions = [m.id for m in g.missions if m]
+        first = []
+        rest = []
+        for src, dest in moves:
+            faces = list(table)
+            faces[dest] = hand[src]
+            key = table_key(faces)
+            if any(self.index.test(m, key) for m in missions):
+                first.append((src, dest))
+            else:
+                rest.append((src, dest))
+        return first + rest
+
+    def play(self, move):
+        # Returns the number of missions solved by the move
+        g = self.game
+        if move is PASS:
+            self.path.append((move, None))
+            g.next_player()
+            return 0
+
+        face = g.table_ids()[move[1]]
+        self.path.append((move, face))
+        self.available[face] -= 1
+        if self.available[face] == 1:
+            self.twice &= ~(1 << face)
+        else:
+            self.once &= ~(1 << face)
+        # push_move counts the passes of finish_turn that solved something, one
+        # pass can solve several missions
+        before = len(g.solved_missions)
+        g.push_move(*move)
+        return len(g.solved_missions) - before
+
+    def undo(self):
+        g = self.game
+        move, face = self.path.pop()
+        if move is PASS:
+            g.turn = (g.turn - 1) % len(g.players)
+            return
+
+        g.pop_move()
+        self.available[face] += 1
+        if self.available[face] == 2:
+            self.twice |= 1 << face
+        else:
+            self.once |= 1 << face
+
+    def search(self, alpha):
+        # Missions that can still be solved from the current state if that is more
+        # than alpha, otherwise an upper bound that is at most alpha
+        g = self.game
+        if g.finished:
+            self.found(0)
+            return 0
+
+        key = self.key()
+        known = self.table.get(key)
+        if known is not None:
+            value, exact, _ = known
+            if exact:
+                self.found(value)
+                return value
+            if value <= alpha:
+                return value
+
+        self.nodes += 1
+        if self.max_nodes and self.nodes > self.max_nodes:
+            raise SearchLimit()
+        if self.deadline and self.nodes % 1024 == 0:
+            if time.perf_counter() > self.deadline:
+                raise SearchLimit()
+
+        bound = self.bound()
+        if bound <= alpha:
+            self.table[key] = (bound, False, None)
+            return bound
+
+        best = -1
+        best_move = None
+        for move in self.ordered_moves():
+            solved = self.play(move)
+            value = solved + self.search(max(alpha, best) - solved)
+            self.undo()
+            if value > best:
+                best = value
+                best_move = move
+                if best >= bound:
+                    break
+
+        self.table[key] = (best, best > alpha, best_move)
+        return best
+
+    def found(self, value):
+        # Keeps the best complete line seen so far, the search reached a state from
+        # which exactly value more missions can be solved
+        g = self.game
+        total = len(g.solved_missions) - self.start_solved + value
+        if total <= self.best:
+            return
+        self.best = total
+        self.best_line = [move for move, _ in self.path] + self.line()
+        if total == self.upper_bound:
+            # Nothing can beat a line that solves every solvable mission
+            raise SearchDone()
+
+    def solve(self):
+        """Searches the game from its current state.
+
+        Returns a dict with the most missions that can be solved ("missions"), an
+        upper bound ("upper_bound"), whether the game can be won, the moves of the
+        best line found (PASS for a player without valid moves) and the search
+        statistics. "complete" tells whether the line is proven to be optimal; if
+        the search hits max_seconds or max_nodes first, the result is the best line
+        found so far.
+        """
+        g = self.game
+        start = time.perf_counter()
+        self.deadline = start + self.max_seconds if self.max_seconds else None
+        self.start_solved = len(g.solved_missions)
+        self.upper_bound = self.bound()
+        self.best = -1
+        self.best_line = []
+        remaining = g.count_remaining_missions()
+
+        try:
+            self.upper_bound = self.search(-1)
+            complete = True
+        except SearchDone:
+            complete = True
+        except SearchLimit:
+            complete = False
+        # Unwind the moves of an interrupted search
+        while self.path:
+            self.undo()
+
+        return {
+            "missions": self.best,
+            "upper_bound": self.upper_bound,
+            "remaining": remaining,
+            "won": self.best == remaining,
+            "complete": complete,
+            "line": self.best_line,
+            "nodes": self.nodes,
+            "states": len(self.table),
+            "seconds": time.perf_counter() - start,
+        }
+
+    def line(self):
+        # Follows the best moves of exactly known states from the current state
+        # without changing it
+        g = self.game
+        moves = []
+        while not g.finished:
+            _, _, move = self.table[self.key()]
+            moves.append(move)
+            self.play(move)
+        for _ in moves:
+            self.undo()
+        return moves
+
+
+def solve(game, max_seconds=None, max_nodes=None):
+    # Convenience wrapper, see Solver.solve
+    return Solver(game, max_seconds, max_nodes).solve()
+
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    description="Solves the deal that CahootsEnv.reset(seed) deals",
+)
+parser.add_argument("--seed", help="Seed of the deal", default=42, type=int)
+parser.add_argument("--missions", help="Number of missions", default=8, type=int)
+parser.add_argument("--players", help="Number of players", default=2, type=int)
+parser.add_argument(
+    "--engine", help="Game engine", default="bitboard", choices=list(ENGINES)
+)
+parser.add_argument(
+    "--max-seconds", help="Give up after this many seconds", default=60, type=float
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    g = ENGINES[args.engine](
+        players=[Player(f"Player {no}") for no in range(0, args.players)],
+        number_of_missions=args.missions,
+        rng=random.Random(args.seed),
+    )
+    g.reset()
+
+    result = solve(g, max_seconds=args.max_seconds)
+    outcome = "won" if result["won"] else "lost"
+    if not result["complete"]:
+        outcome = f"not proven optimal, at most {result['upper_bound']}"
+    print(
+        f"Best: {result['missions']}/{result['remaining']} missions ({outcome}) "
+        f"in {len(result['line'])} moves"
+    )
+    print(
+        "Line:",
+        " ".join("pass" if m is PASS else f"{m[0]}->{m[1]}" for m in result["line"]),
+    )
+    print(
+        f"{result['nodes']} nodes, {result['states']} states, "
+        f"{result['seconds']:.2f} s"
+    )
@@ -0,0 +1,196 @@
+import random
+
+import numpy as np
+
+
+class StreamingStats:
+    """Online statistics of a stream of numbers in fixed memory.
+
+    Keeps the mean of the last `window` values, an exponentially weighted moving
+    average, a reservoir sample for quantile estimates and a history of block
+    means for plotting. When the history is full, neighbouring points are averaged
+    so it covers the whole run with at most `history` points.
+    """
+
+    def __init__(self, window=50, alpha=0.01, history=1000, reservoir=1024, seed=0):
+        self.window = window
+        self.alpha = alpha
+        self.history_size = history
+
+        self.count = 0
+        self.total = 0.0
+        self.ewma = None
+
+        self.recent = np.zeros(window)  # Ring buffer of the last values
+        self.recent_sum = 0.0
+
+        self.history = np.zeros(history)  # Means of consecutive blocks
+        self.history_len = 0
+        self.block = window  # Number of values per history point
+        self.block_sum = 0.0
+        self.block_count = 0
+
+        # Own generator, so sampling does not disturb the game's random streams
+        self.rng = random.Random(seed)
+        self.reservoir = np.zeros(reservoir)
+
+    def add(self, value):
+        value = float(value)
+
+        pos = self.count % self.window
+        self.recent_sum += value - self.recent[pos]
+        self.recent[pos] = value
+
+        if self.count < len(self.reservoir):
+            self.reservoir[self.count] = value
+        else:
+            j = self.rng.randrange(self.count + 1)
+            if j < len(self.reservoir):
+                self.reservoir[j] = value
+
+        self.count += 1
+        self.total += value
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            self.ewma += self.alpha * (value - self.ewma)
+
+        self.block_sum += value
+        self.block_count += 1
+        if self.block_count == self.block:
+            self._finish_block()
+
+    def _finish_block(self):
+        if self.history_len == self.history_size:
+            # The finished block becomes the first half of a twice as big one
+            self._merge_history()
+        else:
+            self.history[self.history_len] = self.block_sum / self.block
+            self.history_len += 1
+            self.block_sum = 0.0
+            self.block_count = 0
+
+    def add_many(self, values):
+        # Same as adding the values one by one, with array operations for large
+        # batches. Their reservoir samples come from a NumPy generator seeded by
+        # self.rng, so they differ from those of add.
+        values = np.asarray(values, dtype=np.float64).ravel()
+        n = len(values)
+        if n < self.window:
+            for value in values.tolist():
+                self.add(value)
+            return
+
+        tail = values[-self.window :]
+        pos = (self.count + n - len(tail) + np.arange(len(tail))) % self.window
+        self.recent[pos] = tail
+        self.recent_sum = float(self.recent.sum())
+
+        size = len(self.reservoir)
+        counts = self.count + np.arange(n)
+        fill = counts < size
+        self.reservoir[counts[fill]] = values[fill]
+        if not fill.all():
+            rng = np.random.default_rng(self.rng.getrandbits(64))
+            j = rng.integers(0, counts[~fill] + 1)
+            hit = j < size
+            self.reservoir[j[hit]] = values[~fill][hit]
+
+        self.count += n
+        self.total += float(values.sum())
+        first = 0
+        if self.ewma is None:
+            self.ewma = float(values[0])
+            first = 1
+        decay = 1 - self.alpha
+        weights = self.alpha * decay ** np.arange(n - first - 1, -1, -1)
+        self.ewma = decay ** (n - first) * self.ewma + float(weights @ values[first:])
+
+        # Block by block, a block has at least window values
+        start = 0
+        while start < n:
+            take = min(self.block - self.block_count, n - start)
+            self.block_sum += float(values[start : start + take].sum())
+            self.block_count += take
+            start += take
+            if self.block_count == self.block:
+                self._finish_block()
+
+    def _merge_history(self):
+        # Merges pairs of points, every point now covers twice as many values
+        half = self.history_size // 2
+        self.history[0:half] = (
+            self.history[0 : 2 * half : 2] + self.history[1 : 2 * half : 2]
+        ) / 2
+        self.history_len = half
+        self.block *= 2
+
+    def window_mean(self):
+        n = min(self.count, self.window)
+        return self.recent_sum / n if n else 0.0
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def quantiles(self, qs):
+        n = min(self.count, len(self.reservoir))
+        if n == 0:
+            return [0.0 for _ in qs]
+        return np.quantile(self.reservoir[0:n], qs).tolist()
+
+    def series(self):
+        # Positions (value index at the end of each block) and block means
+        points = self.history[0 : self.history_len]
+        ends = np.arange(1, self.history_len + 1) * self.block
+        return ends, points
+
+    def summary(self):
+        p50, p90, p99 = self.quantiles([0.5, 0.9, 0.99])
+        return (
+            f"n={self.count} mean={self.mean():.2f} last{self.window}="
+            f"{self.window_mean():.2f} ewma={self.ewma or 0:.2f} "
+            f"p50={p50:.2f} p90={p90:.2f} p99={p99:.2f}"
+        )
+
+    def to_arrays(self):
+        # The full state as arrays, e.g. for checkpoints
+        scalars = [
+            self.count,
+            self.total,
+            np.nan if self.ewma is None else self.ewma,
+            self.recent_sum,
+            self.history_len,
+            self.block,
+            self.block_sum,
+            self.block_count,
+        ]
+        return {
+            "scalars": np.array(scalars, dtype=np.float64),
+            "recent": self.recent,
+            "history": self.history,
+            "reservoir": self.reservoir,
+            "rng": np.array(self.rng.getstate()[1], dtype=np.int64),
+        }
+
+    def load_arrays(self, arrays):
+        (
+            count,
+            self.total,
+            ewma,
+            self.recent_sum,
+            history_len,
+            block,
+            self.block_sum,
+            block_count,
+        ) = arrays["scalars"].tolist()
+        self.count = int(count)
+        self.ewma = None if np.isnan(ewma) else ewma
+        self.history_len = int(history_len)
+        self.block = int(block)
+        self.block_count = int(block_count)
+        self.recent = np.array(arrays["recent"])
+        self.history = np.array(arrays["history"])
+        self.reservoir = np.array(arrays["reservoir"])
+        self.rng.setstate((3, tuple(arrays["rng"].tolist()), None))
+        self.window = len(self.recent)
+        self.history_size = len(self.history)
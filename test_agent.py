@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from agent import Agent
+from cahootsenv import CahootsEnv
+
+
+def new_agent(epsilon=0.0):
+    env = CahootsEnv(
+        render_mode=False, number_of_players=2, number_of_missions=8, outdir=None
+    )
+    return Agent(
+        env,
+        learning_rate=0.1,
+        initial_epsilon=epsilon,
+        epsilon_decay=0.0,
+        final_epsilon=epsilon,
+        discount_factor=0.9,
+        initial_value=0.0,
+    )
+
+
+@pytest.mark.parametrize("masked", [False, True])
+def test_update_batch_matches_sequential_updates(masked):
+    # Repeated state-action pairs, and next states that are never updated so the
+    # targets do not depend on the order of the updates
+    rng = np.random.default_rng(1)
+    n = 500
+    keys = rng.integers(0, 20, n)
+    actions = rng.integers(0, 4, n)
+    rewards = rng.normal(size=n)
+    terminated = rng.random(n) < 0.2
+    next_keys = rng.integers(100, 110, n)
+    next_masks = rng.integers(1, 1 << 16, n) if masked else None
+
+    batch, sequential = new_agent(), new_agent()
+    next_values = rng.normal(size=(10, 16))
+    for agent in (batch, sequential):
+        rows = agent.q_values.rows(range(100, 110))
+        agent.q_values.values[rows] = next_values
+
+    batch.update_batch(keys, actions, rewards, terminated, next_keys, next_masks)
+    for i in range(0, n):
+        sequential.update_keys(
+            int(keys[i]),
+            int(actions[i]),
+            rewards[i],
+            terminated[i],
+            int(next_keys[i]),
+            None if next_masks is None else int(next_masks[i]),
+        )
+
+    states = list(range(0, 20)) + list(range(100, 110))
+    np.testing.assert_allclose(
+        batch.q_values.get_many(states), sequential.q_values.get_many(states), atol=1e-5
+    )
+
+
+def test_get_actions_picks_the_best_legal_action():
+    agent = new_agent()
+    agent.q_values.row(1)[[2, 5, 9]] = [1.0, 3.0, 3.0]
+    keys = np.full(2000, 1)
+    actions, greedy = agent.get_actions(keys)
+    assert greedy.all()
+    # Ties are broken at random
+    assert set(actions.tolist()) == {5, 9}
+
+    masks = np.full(2000, (1 << 2) | (1 << 7))
+    actions, _ = agent.get_actions(keys, masks)
+    assert set(actions.tolist()) == {2}
+
+    agent.epsilon = 1.0
+    actions, greedy = agent.get_actions(keys, masks)
+    assert not greedy.any()
+    assert set(actions.tolist()) == {2, 7}
@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from cahootsenv import CahootsEnv, legal_actions
+
+
+def canonical_env(engine):
+    return CahootsEnv(
+        render_mode=False,
+        number_of_players=2,
+        number_of_missions=8,
+        outdir=None,
+        engine=engine,
+        action_mask=True,
+        canonical=True,
+    )
+
+
+@pytest.mark.parametrize("engine", ["object", "bitboard"])
+def test_canonical_actions_round_trip(engine):
+    env = canonical_env(engine)
+    rng = random.Random(1)
+    for seed in range(1, 21):
+        obs, info = env.reset(seed=seed)
+        done = False
+        while not done:
+            hand = env.cahoots.hand_ids()
+            assert tuple(sorted(hand)) == obs["player_cards"]
+            for action in range(0, 16):
+                # Every canonical action plays the card it names
+                env_action = env.to_env_action(action)
+                assert hand[env_action // 4] == obs["player_cards"][action // 4]
+                assert env_action % 4 == action % 4
+                assert env.to_canonical_action(env_action) <= action
+
+                # Every slot action has a canonical action that plays the same face
+                canonical = env.to_canonical_action(action)
+                assert hand[env.to_env_action(canonical) // 4] == hand[action // 4]
+                assert env.to_canonical_action(env.to_env_action(canonical)) == (
+                    canonical
+                )
+            obs, _, done, _, info = env.step(
+                rng.choice(legal_actions(info["action_mask"]))
+            )
+
+
+@pytest.mark.parametrize("engine", ["object", "bitboard"])
+def test_canonical_mask_keeps_one_copy_of_every_face(engine):
+    env = canonical_env(engine)
+    rng = random.Random(2)
+    for seed in range(1, 21):
+        obs, info = env.reset(seed=seed)
+        done = False
+        while not done:
+            mask = info["action_mask"]
+            legal = env.cahoots.legal_mask()
+            if legal:
+                # The canonical mask covers the same moves, once per face
+                moves = {
+                    (obs["player_cards"][a // 4], a % 4) for a in legal_actions(mask)
+                }
+                hand = env.cahoots.hand_ids()
+                expected = {
+                    (hand[a // 4], a % 4) for a in range(16) if (legal >> a) & 1
+                }
+                assert moves == expected
+                assert len(moves) == len(legal_actions(mask))
+            obs, _, done, _, info = env.step(rng.choice(legal_actions(mask)))
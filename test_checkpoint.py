@@ -0,0 +1,88 @@
+import random
+
+import numpy as np
+
+from agent import Agent
+from cahootsenv import CahootsEnv
+from checkpoint import latest_checkpoint, load_checkpoint, save_checkpoint
+
+
+def new_agent():
+    env = CahootsEnv(
+        render_mode=False, number_of_players=2, number_of_missions=8, outdir=None
+    )
+    agent = Agent(
+        env,
+        learning_rate=0.1,
+        initial_epsilon=1.0,
+        epsilon_decay=0.01,
+        final_epsilon=0.1,
+        discount_factor=0.9,
+        initial_value=0.0,
+    )
+    return agent, env
+
+
+def draws(env):
+    # The next numbers of every random generator a resumed run uses
+    return (
+        random.random(),
+        np.random.random(),
+        env.action_space.sample(),
+        env.cahoots.rng.random(),
+    )
+
+
+def test_checkpoint_round_trip(tmp_path):
+    agent, env = new_agent()
+    rng = np.random.default_rng(1)
+    keys = rng.integers(0, 1 << 40, 300)
+    agent.update_batch(
+        keys,
+        rng.integers(0, 16, 300),
+        rng.normal(size=300),
+        np.zeros(300, dtype=bool),
+        np.roll(keys, 1),
+    )
+    agent.decay_epsilon()
+    stats = {"reward": [1.0, 2.0, 3.0]}
+
+    assert latest_checkpoint(tmp_path) is None
+    save_checkpoint(tmp_path, 10, agent, env, stats)
+    path = save_checkpoint(tmp_path, 20, agent, env, stats)
+    expected = draws(env)
+
+    resumed, resumed_env = new_agent()
+    assert latest_checkpoint(tmp_path) == path
+    episode, loaded = load_checkpoint(path, resumed, resumed_env)
+    assert episode == 20
+    assert loaded["reward"].tolist() == stats["reward"]
+    assert resumed.epsilon == agent.epsilon
+    states = keys.tolist()
+    assert (resumed.q_values.get_many(states) == agent.q_values.get_many(states)).all()
+    assert draws(resumed_env) == expected
+
+    # Updates after loading write to the copy in memory only
+    resumed.q_values.row(states[0])[0] += 1
+    saved, _ = new_agent()
+    load_checkpoint(path, saved, resumed_env)
+    assert saved.q_values.get(states[0])[0] == agent.q_values.get(states[0])[0]
+
+
+def test_older_checkpoints_are_removed(tmp_path):
+    agent, env = new_agent()
+    for episode in range(1, 5):
+        save_checkpoint(tmp_path, episode, agent, env, {}, keep=2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "ckpt-000000003",
+        "ckpt-000000004",
+    ]
+
+
+def test_empty_table_takes_new_states_after_loading(tmp_path):
+    agent, env = new_agent()
+    path = save_checkpoint(tmp_path, 0, agent, env, {})
+    load_checkpoint(path, agent, env)
+    assert len(agent.q_values) == 0
+    agent.q_values.row(5)[1] = 1.0
+    assert agent.q_values.get(5)[1] == 1.0
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from bitgame import BitGame
+from cahoots import Game
+from players import Player
+
+ENGINES = [Game, BitGame]
+
+
+def new_game(engine, seed, players=2, missions=8):
+    g = engine(
+        players=[Player(f"Player {no}") for no in range(0, players)],
+        number_of_missions=missions,
+        rng=random.Random(seed),
+    )
+    g.reset()
+    g.finish_turn(first_time=True)
+    return g
+
+
+def observe(g):
+    # Everything the two engines must agree on, in engine independent form
+    return (
+        g.mission_ids(),
+        g.table_ids(),
+        [g.hand_ids(player) for player in g.players],
+        [m.id for m in g.allmissions],
+        [m.id for m in g.solved_missions],
+        g.played_ids(),
+        g.played_counts,
+        len(g.allcards),
+        [g.legal_mask(player) for player in g.players],
+        g.count_moves(),
+        g.turn,
+        g.finished,
+    )
+
+
+def step(g, rng):
+    # One random action, the way CahootsEnv.step plays it
+    action = rng.randrange(16)
+    src, dest = action // 4, action % 4
+    if g.count_moves() == 0:
+        g.finish_turn()
+    elif not g.valid_move(src, dest):
+        g.finish_turn(valid_move=False)
+    else:
+        g.do_move(src, dest)
+        g.finish_turn()
+
+
+@pytest.mark.parametrize("players", [2, 3])
+def test_engines_play_the_same_games(players):
+    for seed in range(1, 51):
+        games = [new_game(engine, seed, players) for engine in ENGINES]
+        actions = [random.Random(seed) for _ in ENGINES]
+        assert observe(games[0]) == observe(games[1])
+        while not games[0].finished:
+            for g, rng in zip(games, actions):
+                step(g, rng)
+            assert observe(games[0]) == observe(games[1]), seed
+        assert games[1].finished
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_valid_move_matches_legal_mask(engine):
+    for seed in range(1, 21):
+        g = new_game(engine, seed)
+        rng = random.Random(seed)
+        while not g.finished:
+            mask = g.legal_mask()
+            valid = [g.valid_move(a // 4, a % 4) for a in range(16)]
+            assert valid == [(mask >> a) & 1 == 1 for a in range(16)]
+            assert g.count_moves() == mask.bit_count()
+            step(g, rng)
@@ -0,0 +1,26 @@
+import random
+
+from cards import CARDS
+from missionindex import NUMBER_OF_FACES, get_mission_index, table_key
+from missions import MISSIONS
+
+# One card per face, faces are the Card ids
+FACES = CARDS[0::2]
+
+
+def random_tables(seed, n):
+    rng = random.Random(seed)
+    for _ in range(0, n):
+        yield [rng.randrange(NUMBER_OF_FACES) for _ in range(0, 4)]
+
+
+def solved(mission, ids):
+    return mission.test([FACES[face] for face in ids])
+
+
+def test_index_matches_mission_predicates():
+    index = get_mission_index()
+    for ids in random_tables(1, 5000):
+        key = table_key(ids)
+        for mission in MISSIONS:
+            assert index.test(mission.id, key) == solved(mission, ids), (mission, ids)
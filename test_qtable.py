@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from qtable import INITIAL_CAPACITY, QTable, join_key, split_key
+
+
+def test_reading_an_unseen_state_adds_no_row():
+    table = QTable(16, 0.5)
+    assert table.get(7).tolist() == [0.5] * 16
+    assert table.get_many([7, 8]).tolist() == [[0.5] * 16] * 2
+    assert len(table) == 0 and 7 not in table
+
+    table.row(7)[3] = 2.0
+    assert len(table) == 1 and 7 in table
+    assert table.get(7)[3] == 2.0
+    assert table.get_many([8, 7])[:, 3].tolist() == [0.5, 2.0]
+
+
+@pytest.mark.parametrize("key_words", [1, 2])
+def test_rows_survive_growing(key_words):
+    table = QTable(4, 0.0, key_words=key_words)
+    rng = np.random.default_rng(1)
+    keys = [int(k) << (60 * (key_words - 1)) for k in rng.permutation(10**6)[0:3000]]
+    rows = table.rows(keys)
+    assert rows.tolist() == list(range(0, 3000))
+    assert len(table.keys) >= 3000 > INITIAL_CAPACITY
+    table.values[rows, 1] = np.arange(3000)
+
+    assert table.rows(keys).tolist() == rows.tolist()
+    assert table.get_many(keys)[:, 1].tolist() == list(range(0, 3000))
+    stored = [
+        join_key(words) for words in table.keys[0:3000].reshape(3000, -1).tolist()
+    ]
+    assert stored == keys
+
+
+def test_split_and_join_key_round_trip():
+    for key in [0, 1, (1 << 63) - 1, 1 << 63, (1 << 100) + 12345]:
+        assert join_key(split_key(key, 2)) == key
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from bitgame import BitGame
+from players import Player
+from solver import PASS, solve
+
+
+def endgame(seed, missions=20):
+    # A late position of a random game: the deck is empty, so the whole rest of
+    # the game can be searched by brute force
+    g = BitGame(
+        players=[Player(f"Player {no}") for no in range(0, 2)],
+        number_of_missions=missions,
+        rng=random.Random(seed),
+    )
+    g.reset()
+    g.finish_turn(first_time=True)
+    rng = random.Random(seed)
+    while not g.finished and g.allcards:
+        moves = [a for a in range(16) if (g.legal_mask() >> a) & 1]
+        if not moves:
+            g.finish_turn()
+            continue
+        action = rng.choice(moves)
+        g.do_move(action // 4, action % 4)
+        g.finish_turn()
+    return g
+
+
+def state_key(g):
+    return (
+        g.turn,
+        g.finished,
+        tuple(g.table_ids()),
+        tuple(tuple(g.hand_ids(player)) for player in g.players),
+        tuple(g.mission_ids()),
+        tuple(m.id for m in g.allmissions),
+        len(g.allcards),
+    )
+
+
+def brute_force(g, memo):
+    # The most missions that can still be solved, trying every move
+    if g.finished:
+        return 0
+    key = state_key(g)
+    if key in memo:
+        return memo[key]
+    if g.count_moves() == 0:
+        g.next_player()
+        best = brute_force(g, memo)
+        g.turn = (g.turn - 1) % len(g.players)
+    else:
+        best = 0
+        for action in range(0, 16):
+            if not (g.legal_mask() >> action) & 1:
+                continue
+            before = len(g.solved_missions)
+            g.push_move(action // 4, action % 4)
+            solved = len(g.solved_missions) - before
+            best = max(best, solved + brute_force(g, memo))
+            g.pop_move()
+    memo[key] = best
+    return best
+
+
+# Seeds 25, 39 and 41 fail when a move that solves two missions counts as one
+@pytest.mark.parametrize("seed", range(21, 43))
+def test_solver_matches_brute_force(seed):
+    g = endgame(seed)
+    if g.finished:
+        return
+    expected = brute_force(g, {})
+    result = solve(g)
+    assert result["complete"]
+    assert result["missions"] == expected
+    assert result["upper_bound"] >= result["missions"]
+
+    # The line solves as many missions as promised
+    before = len(g.solved_missions)
+    for move in result["line"]:
+        if move is PASS:
+            g.next_player()
+        else:
+            g.push_move(*move)
+    assert len(g.solved_missions) - before == expected
+    assert g.finished
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from bitgame import BitGame
+from test_engines import ENGINES, new_game, observe, step
+
+
+def snapshot(g):
+    # The complete state of a game, undoing moves has to restore all of it
+    if isinstance(g, BitGame):
+        state = (g.table, g.table_key, list(g.hands), list(g.playable))
+    else:
+        state = (
+            list(g.table_cards),
+            [list(player.cards) for player in g.players],
+            list(g.playable),
+        )
+    return state + (
+        list(g.allcards),
+        list(g.missions),
+        list(g.missions_checked),
+        list(g.allmissions),
+        list(g.solved_missions),
+        list(g.played_cards),
+        g.played_counts,
+        g.turn,
+        g.finished,
+    )
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pop_move_undoes_push_move(engine):
+    rng = random.Random(3)
+    for seed in range(1, 31):
+        g = new_game(engine, seed)
+        while not g.finished:
+            moves = [a for a in range(16) if (g.legal_mask() >> a) & 1]
+            if not moves:
+                g.finish_turn()
+                continue
+
+            # A few moves deep and back again, all the way to the same state
+            before = snapshot(g)
+            seen = observe(g)
+            for _ in range(0, 3):
+                valid = [a for a in range(16) if (g.legal_mask() >> a) & 1]
+                if g.finished or not valid:
+                    break
+                action = rng.choice(valid)
+                g.push_move(action // 4, action % 4)
+            while g.undo_log:
+                g.pop_move()
+            assert snapshot(g) == before
+            assert observe(g) == seen
+
+            action = rng.choice(moves)
+            g.do_move(action // 4, action % 4)
+            g.finish_turn()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_clone_and_restore_leave_the_original_alone(engine):
+    g = new_game(engine, 7)
+    start = g.clone()
+    seen = observe(g)
+
+    clone = g.clone()
+    rng = random.Random(7)
+    while not clone.finished:
+        step(clone, rng)
+    assert observe(g) == seen
+
+    rng = random.Random(7)
+    while not g.finished:
+        step(g, rng)
+    assert observe(g) == observe(clone)
+
+    g.restore(start)
+    assert observe(g) == seen
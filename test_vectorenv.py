@@ -0,0 +1,91 @@
+import random
+
+import numpy as np
+import pytest
+
+from cahootsenv import CahootsEnv
+from vectorenv import VectorCahootsEnv
+
+OBSERVATION_KEYS = ["current_missions", "table_cards", "player_cards"]
+
+
+def single_envs(num_envs, players, missions):
+    # One CahootsEnv per game of the vector env, each on its own seeded deal that
+    # is copied into the vector env
+    vec = VectorCahootsEnv(num_envs, players, missions)
+    vec.reset(seed=0)
+    envs = []
+    for i in range(0, num_envs):
+        env = CahootsEnv(
+            render_mode=False,
+            number_of_players=players,
+            number_of_missions=missions,
+            outdir=None,
+            engine="bitboard",
+            action_mask=True,
+        )
+        env.reset(seed=i + 1)
+        vec.load_game(i, env.cahoots)
+        envs.append(env)
+    return vec, envs
+
+
+@pytest.mark.parametrize("players", [2, 3])
+def test_vector_env_matches_cahootsenv(players):
+    num_envs = 32
+    vec, envs = single_envs(num_envs, players, 8)
+    masks = [env.legal_mask() for env in envs]
+    assert vec._action_mask().tolist() == masks
+
+    rng = random.Random(players)
+    alive = np.ones(num_envs, dtype=bool)
+    while alive.any():
+        actions = np.array([rng.randrange(16) for _ in range(0, num_envs)])
+        obs, rewards, terminated, _, info = vec.step(actions)
+        final = info["final_observation"] if terminated.any() else obs
+
+        for i in np.flatnonzero(alive):
+            expected, reward, done, _, state = envs[i].step(actions[i])
+            assert reward == rewards[i]
+            assert done == terminated[i]
+            for key in OBSERVATION_KEYS:
+                assert list(expected[key]) == final[key][i].tolist()
+            assert len(state["missions_remaining"]) == info["missions_remaining"][i]
+            assert state["cards_left"] == info["cards_left"][i]
+            if done:
+                # The vector env already dealt the next game
+                alive[i] = False
+            else:
+                assert state["action_mask"] == info["action_mask"][i]
+
+
+def test_vector_env_resets_finished_games():
+    vec = VectorCahootsEnv(16, 2, 8)
+    obs, info = vec.reset(seed=1)
+    rng = np.random.default_rng(1)
+    finished = 0
+    for _ in range(0, 400):
+        obs, _, terminated, _, info = vec.step(rng.integers(0, 16, 16))
+        finished += terminated.sum()
+        # Every game is running again after the step that ended it, on a new deal,
+        # while the info still describes the game that ended
+        assert not vec.finished.any()
+        assert (vec.cards_left[terminated] == 56 - 4 - 4 * 2).all()
+        assert info["finished"][terminated].all()
+    assert finished > 0
+
+
+def test_vector_env_replays_a_seed():
+    # The same seed and actions give the same games, including the new deals
+    vecs = [VectorCahootsEnv(8, 2, 8) for _ in range(0, 2)]
+    results = [[(vec.reset(seed=5)[0],)] for vec in vecs]
+    rng = np.random.default_rng(5)
+    for _ in range(0, 200):
+        actions = rng.integers(0, 16, 8)
+        for vec, result in zip(vecs, results):
+            result.append(vec.step(actions)[0:3])
+    for a, b in zip(*results):
+        for key in OBSERVATION_KEYS:
+            assert (a[0][key] == b[0][key]).all()
+        for x, y in zip(a[1:], b[1:]):
+            assert (x == y).all()
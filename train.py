@@ -1,15 +1,21 @@
-import numpy as np
 import os
 
-import gymnasium as gym
 from cahootsenv import CahootsEnv
 
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
+from actors import run_actor, save_policy, worker_seed
 from agent import Agent
+from checkpoint import latest_checkpoint, load_checkpoint, save_checkpoint
+from evaluate import evaluate, format_summary, summary
+from stats import StreamingStats
 
 import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
 
 
 class DefaultHelpFormatter(
@@ -38,6 +44,51 @@ def training_section(parser):
     training_group.add_argument(
         "--outdir", help="Output directory for screenshots if set", default=None
     )
+    training_group.add_argument(
+        "--workers",
+        help="Number of actor processes (1 plays all episodes in this process)",
+        default=1,
+        type=int,
+    )
+    training_group.add_argument(
+        "--sync-every",
+        help="Episodes every actor plays before it gets a fresh copy of the policy",
+        default=100,
+        type=int,
+    )
+    training_group.add_argument(
+        "--update-batch",
+        help="With workers, apply the actors' transitions this many at a time with Agent.update_batch (1 updates them one by one)",
+        default=1,
+        type=int,
+    )
+    training_group.add_argument(
+        "--checkpoint-dir",
+        help="Directory for periodic checkpoints (no checkpoints if not set)",
+        default=None,
+    )
+    training_group.add_argument(
+        "--checkpoint-every",
+        help="Write a checkpoint after this many episodes",
+        default=1000,
+        type=int,
+    )
+    training_group.add_argument(
+        "--resume",
+        help="Resume from the latest checkpoint in --checkpoint-dir",
+        action="store_true",
+    )
+    training_group.add_argument(
+        "--eval-games",
+        help="Games the greedy policy plays after training, without exploration (on the training deal with a fixed seed)",
+        default=0,
+        type=int,
+    )
+    training_group.add_argument(
+        "--profile",
+        help="Time the phases of every step and print a breakdown at the end",
+        action="store_true",
+    )
 
 
 def agent_section(parser):
@@ -57,6 +108,28 @@ def agent_section(parser):
     agent_group.add_argument(
         "--initial", help="Initial learning value", default=1000.0, type=float
     )
+    agent_group.add_argument(
+        "--action-mask",
+        help="Explore and maximize over the valid actions only, using the action masks of the environment (invalid moves are still penalized if chosen)",
+        action="store_true",
+    )
+    agent_group.add_argument(
+        "--canonical",
+        help="Sort the hand by face and share the Q-values of all orderings of a hand, report with benchmark.py --canonical-episodes",
+        action="store_true",
+    )
+    agent_group.add_argument(
+        "--planning-steps",
+        help="Transitions replayed from the replay buffer after every real update (Dyna-style planning, 0 disables it)",
+        default=0,
+        type=int,
+    )
+    agent_group.add_argument(
+        "--replay-capacity",
+        help="Number of transitions kept for planning, a resumed run starts with an empty buffer",
+        default=100000,
+        type=int,
+    )
 
 
 def cahoots_section(parser):
@@ -67,6 +140,17 @@ def cahoots_section(parser):
     cahoots_group.add_argument(
         "--players", help="Number of players", default=2, type=int
     )
+    cahoots_group.add_argument(
+        "--engine",
+        help="Game engine: object (cahoots.Game) or bitboard (bitgame.BitGame)",
+        default="object",
+        choices=["object", "bitboard"],
+    )
+    cahoots_group.add_argument(
+        "--card-counting",
+        help="Add the played copies of every card face to the observation",
+        action="store_true",
+    )
 
 
 parser = argparse.ArgumentParser(formatter_class=DefaultHelpFormatter)
@@ -97,8 +181,14 @@ env = CahootsEnv(
     number_of_players=args.players,
     number_of_missions=args.missions,
     outdir=args.outdir,
+    engine=args.engine,
+    obs_mode="key",
+    render_process=True,
+    profile=args.profile,
+    card_counting=args.card_counting,
+    action_mask=args.action_mask,
+    canonical=args.canonical,
 )
-env = gym.wrappers.RecordEpisodeStatistics(env, deque_size=args.episodes)
 
 epsilon_decay = args.start_epsilon / (
     args.episodes / 2
@@ -111,62 +201,253 @@ agent = Agent(
     final_epsilon=args.final_epsilon,
     discount_factor=args.discount_factor,
     initial_value=float(args.initial),
+    planning_steps=args.planning_steps,
+    replay_capacity=args.replay_capacity,
 )
 
-total_wons = 0
-
-for episode in tqdm(range(args.episodes)):
-    i = 0
-    obs, info = env.reset(seed=args.seed)
-    done = False
-
-    if episode >= args.episodes * num_render_p / 100:
-        env.set_render(True)
-
-    while not done:
-        i += 1
-        action, t = agent.get_action(env, obs)
+if args.profile:
+    env.profiler.wrap(agent, "get_action_for_key", "get_action")
+    env.profiler.wrap(agent, "update_keys", "update")
+    env.profiler.wrap(agent, "update_batch", "update")
 
-        next_obs, reward, terminated, truncated, state = env.step(action)
-
-        if len(state["missions_remaining"]) == 0:
-            total_wons += 1
-
-        # update the agent
-        agent.update(env, obs, action, reward, terminated, next_obs)
+total_wons = 0
+start_episode = 0
+
+# Rolling statistics in fixed memory, whatever the number of episodes
+statistics = {
+    "returns": StreamingStats(),
+    "lengths": StreamingStats(),
+    "training_error": agent.training_error,
+}
+
+
+def save(episode):
+    arrays = {"total_wons": [total_wons]}
+    for name, stat in statistics.items():
+        for field, values in stat.to_arrays().items():
+            arrays[f"{name}.{field}"] = values
+    save_checkpoint(args.checkpoint_dir, episode, agent, env, arrays)
+
+
+if args.resume:
+    path = latest_checkpoint(args.checkpoint_dir) if args.checkpoint_dir else None
+    if path:
+        start_episode, stats = load_checkpoint(path, agent, env)
+        total_wons = int(stats["total_wons"][0])
+        for name, stat in statistics.items():
+            stat.load_arrays(
+                {
+                    field[len(name) + 1 :]: values
+                    for field, values in stats.items()
+                    if field.startswith(f"{name}.")
+                }
+            )
+        agent.training_error = statistics["training_error"]
+        print(f"Resumed from '{path}' at episode {start_episode}")
+    else:
+        print("No checkpoint found - starting from scratch")
+
+
+def train_serial():
+    global total_wons
+
+    for episode in tqdm(
+        range(start_episode, args.episodes), initial=start_episode, total=args.episodes
+    ):
+        i = 0
+        episode_return = 0
+        obs, info = env.reset(seed=args.seed or None)
+        mask = info["action_mask"] if env.masks else None
+        done = False
+
+        if episode >= args.episodes * num_render_p / 100:
+            env.set_render(True)
+
+        while not done:
+            i += 1
+            action, t = agent.get_action(env, obs, mask)
+
+            next_obs, reward, terminated, truncated, state = env.step(action)
+
+            if state["won"]:
+                total_wons += 1
+
+            # update the agent
+            if env.masks:
+                mask = state["action_mask"]
+            agent.update(env, obs, action, reward, terminated, next_obs, mask)
+
+            episode_return += reward
+            done = terminated or truncated
+            obs = next_obs
+
+        statistics["returns"].add(episode_return)
+        statistics["lengths"].add(i)
+        agent.decay_epsilon()
+
+        if args.checkpoint_dir and (episode + 1) % args.checkpoint_every == 0:
+            save(episode + 1)
+
+
+def train_parallel():
+    # Actor processes play episodes with a snapshot of the policy that is refreshed
+    # every round, this process applies their transitions to the agent in worker
+    # order so that a run only depends on the seeds
+    global total_wons
+
+    policy_dir = tempfile.mkdtemp(prefix="cahoots-policy-")
+    pool = multiprocessing.get_context("fork").Pool(args.workers)
+    progress = tqdm(initial=start_episode, total=args.episodes)
+
+    episode = start_episode
+    while episode < args.episodes:
+        round_no = episode // args.sync_every
+        policy = None
+        if len(agent.q_values):
+            policy = save_policy(agent.q_values, policy_dir, round_no)
+
+        tasks = []
+        offset = 0
+        for worker in range(args.workers):
+            episodes = min(args.sync_every, args.episodes - episode - offset)
+            if episodes <= 0:
+                break
+            tasks.append(
+                {
+                    "players": args.players,
+                    "missions": args.missions,
+                    "engine": args.engine,
+                    "env_seed": args.seed or None,
+                    "seed": worker_seed(args.seed, round_no, worker),
+                    "policy": policy,
+                    "episodes": episodes,
+                    "epsilon": max(
+                        agent.final_epsilon, agent.epsilon - offset * epsilon_decay
+                    ),
+                    "epsilon_decay": epsilon_decay,
+                    "final_epsilon": agent.final_epsilon,
+                    "initial_value": agent.initial_value,
+                    "profile": args.profile,
+                    "card_counting": args.card_counting,
+                    "action_mask": args.action_mask,
+                    "canonical": args.canonical,
+                }
+            )
+            offset += episodes
+
+        for result in pool.map(run_actor, tasks):
+            transitions = result["transitions"]
+            if args.update_batch > 1:
+                for start in range(0, len(transitions), args.update_batch):
+                    batch = transitions[start : start + args.update_batch]
+                    agent.update_batch(
+                        batch["key"],
+                        batch["action"],
+                        batch["reward"],
+                        batch["done"],
+                        batch["next_key"],
+                        batch["next_mask"],
+                    )
+            else:
+                for key, action, reward, next_key, done, next_mask in zip(
+                    transitions["key"].tolist(),
+                    transitions["action"].tolist(),
+                    transitions["reward"].tolist(),
+                    transitions["next_key"].tolist(),
+                    transitions["done"].tolist(),
+                    transitions["next_mask"].tolist(),
+                ):
+                    agent.update_keys(key, action, reward, done, next_key, next_mask)
+
+            statistics["returns"].add_many(result["returns"])
+            statistics["lengths"].add_many(result["lengths"])
+            total_wons += result["wons"]
+            if args.profile:
+                env.profiler.merge(result["profile"])
+
+        for _ in range(offset):
+            agent.decay_epsilon()
+
+        if policy:
+            shutil.rmtree(policy)
+
+        if args.checkpoint_dir and (
+            (episode + offset) // args.checkpoint_every
+            > episode // args.checkpoint_every
+        ):
+            save(episode + offset)
+
+        episode += offset
+        progress.update(offset)
+
+    progress.close()
+    pool.close()
+    shutil.rmtree(policy_dir)
+
+
+train_start = time.perf_counter_ns()
+if args.workers > 1:
+    train_parallel()
+else:
+    train_serial()
+train_ns = time.perf_counter_ns() - train_start
 
-        done = terminated or truncated
-        obs = next_obs
+if args.checkpoint_dir:
+    save(args.episodes)
 
-    agent.decay_epsilon()
+print("Total wons:", total_wons)
+print(
+    f"Q-table: {len(agent.q_values)} states, "
+    f"{agent.q_values.bytes_per_state():.0f} bytes/state, "
+    f"{agent.q_values.nbytes() / 2**20:.1f} MiB"
+)
+if agent.replay is not None:
+    print(
+        f"Replay buffer: {len(agent.replay)} transitions, "
+        f"{agent.replay.nbytes() / 2**20:.1f} MiB"
+    )
 
+for name, stat in statistics.items():
+    print(f"{name}: {stat.summary()}")
+
+if args.eval_games:
+    policy_dir = tempfile.mkdtemp(prefix="cahoots-policy-")
+    agent.q_values.save(policy_dir)
+    eval_start = time.perf_counter()
+    results = evaluate(
+        args.eval_games,
+        policy=policy_dir,
+        initial_value=agent.initial_value,
+        seed=args.seed or 1,
+        same_deal=args.seed != 0,
+        workers=args.workers,
+        players=args.players,
+        missions=args.missions,
+        engine=args.engine,
+        action_mask=args.action_mask,
+        canonical=args.canonical,
+    )
+    print("Greedy policy:")
+    print(format_summary(summary(results, time.perf_counter() - eval_start)))
+    shutil.rmtree(policy_dir)
 
-print("Total wons:", total_wons)
+if args.profile:
+    # With workers the actor phases overlap, so they are shown as shares of the
+    # measured time instead of the wall-clock time
+    print(f"Profile ({train_ns / 1e9:.1f} s wall-clock):")
+    print(env.profiler.table(train_ns if args.workers == 1 else None))
 
-rolling_length = 50
 fig, axs = plt.subplots(ncols=3, figsize=(12, 5))
-axs[0].set_title("Episode rewards")
-# compute and assign a rolling average of the data to provide a smoother graph
-reward_moving_average = (
-    np.convolve(
-        np.array(env.return_queue).flatten(), np.ones(rolling_length), mode="valid"
-    )
-    / rolling_length
-)
-axs[0].plot(range(len(reward_moving_average)), reward_moving_average)
-axs[1].set_title("Episode lengths")
-length_moving_average = (
-    np.convolve(
-        np.array(env.length_queue).flatten(), np.ones(rolling_length), mode="same"
-    )
-    / rolling_length
-)
-axs[1].plot(range(len(length_moving_average)), length_moving_average)
-axs[2].set_title("Training Error")
-training_error_moving_average = (
-    np.convolve(np.array(agent.training_error), np.ones(rolling_length), mode="same")
-    / rolling_length
-)
-axs[2].plot(range(len(training_error_moving_average)), training_error_moving_average)
+for ax, (title, name) in zip(
+    axs,
+    [
+        ("Episode rewards", "returns"),
+        ("Episode lengths", "lengths"),
+        ("Training Error", "training_error"),
+    ],
+):
+    # Means of consecutive blocks of the data to provide a smoother graph
+    ax.set_title(title)
+    ax.plot(*statistics[name].series())
 plt.tight_layout()
 plt.show()
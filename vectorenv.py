@@ -0,0 +1,262 @@
+import numpy as np
+
+from gymnasium import spaces
+
+from bitgame import ATTR, EMPTY, NUMBER_OF_CARDS
+from cahootsenv import ALL_ACTIONS, REWARDS
+from missionindex import STRIDE, get_mission_index
+
+# Color/number mask per card code, EMPTY hand slots get no attributes at all so
+# they never match a table card
+CARD_ATTR = np.zeros(EMPTY + 1, dtype=np.int16)
+CARD_ATTR[0:NUMBER_OF_CARDS] = ATTR
+
+NUMBER_OF_MISSIONS = 54
+
+
+class VectorCahootsEnv:
+    """N Cahoots games stored as NumPy arrays and stepped all at once.
+
+    Every game follows the semantics of CahootsEnv.step, with the same rewards, and
+    is reset automatically when it terminates. Cards are stored as bitgame codes
+    (face = code >> 1), missions by their id. Observations are a dict of (N, 4)
+    arrays with the same keys and values as CahootsEnv observations, the info has
+    the action masks of CahootsEnv(action_mask=True) as "action_mask".
+    """
+
+    def __init__(
+        self, num_envs, number_of_players, number_of_missions, fixed_deal=False
+    ):
+        self.num_envs = num_envs
+        self.number_of_players = number_of_players
+        self.number_of_missions = number_of_missions
+        self.fixed_deal = fixed_deal  # Every reset restores the first deal
+
+        self.single_action_space = spaces.Discrete(16)
+        self.action_space = spaces.MultiDiscrete([16] * num_envs)
+
+        index = get_mission_index()
+        self.mission_bits = np.frombuffer(index.bits, dtype=np.uint8).reshape(
+            NUMBER_OF_MISSIONS, STRIDE
+        )
+
+        n = num_envs
+        self.decks = np.zeros((n, NUMBER_OF_CARDS), dtype=np.int8)
+        self.cards_left = np.zeros(n, dtype=np.int32)
+        self.hands = np.full((n, number_of_players, 4), EMPTY, dtype=np.int8)
+        self.table = np.zeros((n, 4), dtype=np.int8)
+        self.mission_stack = np.zeros((n, number_of_missions), dtype=np.int16)
+        self.missions_left = np.zeros(n, dtype=np.int32)
+        self.missions = np.full((n, 4), -1, dtype=np.int16)
+        self.missions_solved = np.zeros(n, dtype=np.int32)
+        self.turn = np.zeros(n, dtype=np.int32)
+        self.finished = np.zeros(n, dtype=bool)
+
+        self.rng = np.random.default_rng()
+        self.deal = None
+
+        self._all = np.arange(n)
+
+    def _new_deals(self, count):
+        # Random card orders and mission stacks for count games
+        decks = np.argsort(self.rng.random((count, NUMBER_OF_CARDS)), axis=1)
+        missions = np.argsort(self.rng.random((count, NUMBER_OF_MISSIONS)), axis=1)
+        return decks, missions[:, 0 : self.number_of_missions]
+
+    def _reset_games(self, idx):
+        # Deals new games in the given slots, in the same order as Game.reset
+        if self.fixed_deal:
+            decks = np.repeat(self.deal[0], len(idx), axis=0)
+            stacks = np.repeat(self.deal[1], len(idx), axis=0)
+        else:
+            decks, stacks = self._new_deals(len(idx))
+
+        self.decks[idx] = decks
+        self.mission_stack[idx] = stacks
+
+        # Missions are popped from the end of the stack
+        count = min(self.number_of_missions, 4)
+        self.missions[idx] = -1
+        for pos in range(0, count):
+            self.missions[idx, pos] = stacks[:, self.number_of_missions - 1 - pos]
+        self.missions_left[idx] = self.number_of_missions - count
+
+        # Cards are popped from the end of the deck: first the table, then the hands
+        top = NUMBER_OF_CARDS - 1
+        for pos in range(0, 4):
+            self.table[idx, pos] = decks[:, top - pos]
+        top -= 4
+        for p in range(0, self.number_of_players):
+            for pos in range(0, 4):
+                self.hands[idx, p, pos] = decks[:, top - pos]
+            top -= 4
+        self.cards_left[idx] = top + 1
+
+        self.missions_solved[idx] = 0
+        self.turn[idx] = 0
+        self.finished[idx] = False
+
+    def load_game(self, i, game):
+        # Copies the state of a BitGame into slot i, e.g. to replay a known deal
+        n = len(game.allcards)
+        self.decks[i, 0:n] = game.allcards
+        self.cards_left[i] = n
+        self.table[i] = game.table_codes()
+        for p, player in enumerate(game.players):
+            self.hands[i, p] = game.hand_codes(player)
+        self.mission_stack[i, 0 : len(game.allmissions)] = [
+            m.id for m in game.allmissions
+        ]
+        self.missions_left[i] = len(game.allmissions)
+        self.missions[i] = -1
+        self.missions[i, 0 : len(game.missions)] = game.mission_ids()
+        self.missions_solved[i] = len(game.solved_missions)
+        self.turn[i] = game.turn
+        self.finished[i] = game.finished
+
+    def _get_obs(self):
+        hands = self.hands[:, 0].astype(np.int16)
+        return {
+            "current_missions": self.missions.copy(),
+            "table_cards": self.table.astype(np.int16) >> 1,
+            "player_cards": np.where(hands == EMPTY, -1, hands >> 1),
+        }
+
+    def _get_info(self):
+        return {
+            "missions_total": np.full(self.num_envs, self.number_of_missions),
+            "missions_remaining": self.missions_left + (self.missions >= 0).sum(axis=1),
+            "missions_solved": self.missions_solved.copy(),
+            "cards_left": self.cards_left.copy(),
+            "finished": self.finished.copy(),
+        }
+
+    def _compatible(self):
+        # (N, players, 4, 4) array telling which hand card fits on which stack
+        hand_attr = CARD_ATTR[self.hands]
+        table_attr = CARD_ATTR[self.table]
+        return (hand_attr[:, :, :, None] & table_attr[:, None, None, :]) != 0
+
+    def _check_missions(self, active):
+        # One pass of Game.check_missions over the active games, returns the
+        # games in which at least one mission was solved
+        faces = self.table.astype(np.int32) >> 1
+        key = ((faces[:, 0] * 28 + faces[:, 1]) * 28 + faces[:, 2]) * 28 + faces[:, 3]
+
+        fulfilled = np.zeros(self.num_envs, dtype=bool)
+        for pos in range(0, 4):
+            mission = self.missions[:, pos]
+            hit = np.flatnonzero(active & (mission >= 0))
+            if len(hit) == 0:
+                continue
+            bits = self.mission_bits[mission[hit], key[hit] >> 3]
+            hit = hit[((bits >> (key[hit] & 7)) & 1) == 1]
+            if len(hit) == 0:
+                continue
+
+            fulfilled[hit] = True
+            self.missions_solved[hit] += 1
+
+            self.missions[hit, pos] = -1
+            refill = hit[self.missions_left[hit] > 0]
+            self.missions_left[refill] -= 1
+            self.missions[refill, pos] = self.mission_stack[
+                refill, self.missions_left[refill]
+            ]
+        return fulfilled
+
+    def _finish_turn(self, valid_move):
+        # Vectorized Game.finish_turn for all games
+        solved_mission_count = np.zeros(self.num_envs, dtype=np.int32)
+
+        solved_mission = np.ones(self.num_envs, dtype=bool)
+        while solved_mission.any():
+            solved_mission = self._check_missions(solved_mission)
+            solved_mission_count += solved_mission
+
+        won = (self.missions_left == 0) & (self.missions < 0).all(axis=1)
+        no_moves = ~self._compatible().any(axis=(1, 2, 3))
+        self.finished = won | no_moves
+
+        advance = ~self.finished & valid_move & (solved_mission_count == 0)
+        self.turn[advance] = (self.turn[advance] + 1) % self.number_of_players
+
+        return solved_mission_count
+
+    def _do_move(self, idx, src, dst):
+        # Vectorized Game.do_move for the games in idx
+        p = self.turn[idx]
+        self.table[idx, dst] = self.hands[idx, p, src]
+
+        has_card = self.cards_left[idx] > 0
+        top = np.maximum(self.cards_left[idx] - 1, 0)
+        self.hands[idx, p, src] = np.where(has_card, self.decks[idx, top], EMPTY)
+        self.cards_left[idx] -= has_card
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        src = actions // 4
+        dst = actions % 4
+
+        current = self._compatible()[self._all, self.turn]
+        no_moves = ~current.any(axis=(1, 2))
+        valid = ~no_moves & current[self._all, src, dst]
+        invalid = ~no_moves & ~valid
+
+        reward = np.where(invalid, REWARDS["INVALID_MOVE"], 0).astype(np.int32)
+
+        idx = np.flatnonzero(valid)
+        self._do_move(idx, src[idx], dst[idx])
+
+        solved_mission_count = self._finish_turn(~invalid)
+        reward += np.where(
+            valid,
+            REWARDS["VALID_MOVE"]
+            + REWARDS["MISSION_ACCOMPLISHED"] * solved_mission_count,
+            0,
+        )
+
+        # Check for the end conditions of the games
+        info = self._get_info()
+        terminated = self.finished.copy()
+        won = info["missions_remaining"] == 0
+        reward += np.where(
+            terminated,
+            np.where(won, REWARDS["WON_GAME"], REWARDS["LOST_GAME"]),
+            0,
+        )
+
+        observation = self._get_obs()
+
+        # Auto-reset finished games, the observations before the reset are kept
+        # in the info dict
+        done = np.flatnonzero(terminated)
+        if len(done):
+            info["final_observation"] = observation
+            info["_final_observation"] = terminated
+            self._reset_games(done)
+            observation = self._get_obs()
+
+        info["action_mask"] = self._action_mask()
+
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        return observation, reward, terminated, truncated, info
+
+    def reset(self, seed=None, options=None):
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        if self.fixed_deal:
+            self.deal = self._new_deals(1)
+
+        self._reset_games(self._all)
+
+        info = self._get_info()
+        info["action_mask"] = self._action_mask()
+        return self._get_obs(), info
+
+    def _action_mask(self):
+        # 16 bit masks of the valid actions of the players to move, see
+        # CahootsEnv.legal_mask
+        current = self._compatible()[self._all, self.turn].reshape(self.num_envs, 16)
+        mask = current.astype(np.int32) @ (1 << np.arange(16, dtype=np.int32))
+        return np.where(mask == 0, ALL_ACTIONS, mask).astype(np.uint16)
@@ -1,5 +1,10 @@
-import pygame
+import atexit
+import multiprocessing
 import os
+import queue
+
+import pygame
+
 from colors import Color
 
 
@@ -18,25 +23,36 @@ class Visuals:
         self.pygame_inited = False
 
     def initialize_pygame(self):
-        # Initializes pygame
+        # Initializes pygame, the fonts and the sprite caches
         pygame.init()
 
         self.screen = pygame.display.set_mode(
             (Visuals.screen_width, Visuals.screen_height)
         )
 
+        self.text_font = pygame.font.SysFont(None, 24, bold=False)
+        self.card_font = pygame.font.SysFont(None, 24, bold=True)
+        self.card_sprites = {}  # (color, number) -> rendered card
+        self.text_sprites = {}  # text -> rendered mission text
+
         self.pygame_inited = True
 
+    def _text_sprite(self, text):
+        # Mission texts repeat all the time, so they are rendered only once
+        sprite = self.text_sprites.get(text)
+        if sprite is None:
+            sprite = self.text_font.render(text, True, "black")
+            self.text_sprites[text] = sprite
+        return sprite
+
     def render_missions(self, missions):
         # Renders all missions on the deck
-        font = pygame.font.SysFont(None, 24, bold=False)
-
         x = Visuals.card_margin
         y = 20
 
         for mission in missions:
             description = "-" if not mission else mission
-            img = font.render(f"{description}", True, "black")
+            img = self._text_sprite(f"{description}")
             self.screen.blit(img, (x + Visuals.card_width / 3, y))
             y += 30
 
@@ -59,16 +75,19 @@ class Visuals:
         if color == Color.Purple:
             return "purple"
 
-    def render_card(self, positionx, positiony, color, number):
-        # Makes a nice rounded card with the number in it
-        x = Visuals.card_margin * (positionx + 1) + positionx * Visuals.card_width
-        y = Visuals.card_margin * (positiony + 1) + positiony * Visuals.card_height
+    def _card_sprite(self, color, number):
+        # Makes a nice rounded card with the number in it, once per card face
+        sprite = self.card_sprites.get((color, number))
+        if sprite is not None:
+            return sprite
 
-        font = pygame.font.SysFont(None, 24, bold=True)
+        sprite = pygame.Surface(
+            (Visuals.card_width, Visuals.card_height), pygame.SRCALPHA
+        )
         pygame.draw.rect(
-            self.screen,
+            sprite,
             self._color_to_gamecolor(color),
-            [x, y, Visuals.card_width, Visuals.card_height],
+            [0, 0, Visuals.card_width, Visuals.card_height],
             0,
             border_radius=5,
         )
@@ -78,8 +97,16 @@ class Visuals:
         if color == Color.Green or color == Color.Purple:
             fontcolor = "white"
 
-        img = font.render(f"{number}", True, fontcolor)
-        self.screen.blit(img, (x + Visuals.card_width / 3, y + Visuals.card_height / 2))
+        img = self.card_font.render(f"{number}", True, fontcolor)
+        sprite.blit(img, (Visuals.card_width / 3, Visuals.card_height / 2))
+
+        self.card_sprites[(color, number)] = sprite
+        return sprite
+
+    def render_card(self, positionx, positiony, color, number):
+        x = Visuals.card_margin * (positionx + 1) + positionx * Visuals.card_width
+        y = Visuals.card_margin * (positiony + 1) + positiony * Visuals.card_height
+        self.screen.blit(self._card_sprite(color, number), (x, y))
 
     def render_description(self, desc):
         # Generic info line to be rendered at the bottom of the screen
@@ -88,21 +115,24 @@ class Visuals:
         x = Visuals.card_margin * (positionx + 1) + positionx * Visuals.card_width
         y = Visuals.card_margin * (positiony + 1) + positiony * Visuals.card_height
 
-        font = pygame.font.SysFont(None, 24, bold=False)
-        img = font.render(desc, True, "black")
+        img = self.text_font.render(desc, True, "black")
         self.screen.blit(img, (x + Visuals.card_width / 3, y + Visuals.card_height / 2))
 
     def draw(self, missions, table_cards, player_cards, description):
+        self.draw_frame(*frame_state(missions, table_cards, player_cards, description))
+
+    def draw_frame(self, missions, table_cards, player_cards, description):
+        # Draws a frame as built by frame_state
         if not self.pygame_inited:
             self.initialize_pygame()
 
         self.screen.fill("white")
         self.render_missions(missions)
-        for i, c in enumerate(table_cards):
-            self.render_deck_card(i, c.color, c.number)
+        for i, (color, number) in enumerate(table_cards):
+            self.render_deck_card(i, Color(color), number)
         for i, c in enumerate(player_cards):
             if c:
-                self.render_player_card(i, c.color, c.number)
+                self.render_player_card(i, Color(c[0]), c[1])
 
         self.render_description(description)
 
@@ -116,3 +146,106 @@ class Visuals:
             )
 
         self.p += 1
+
+
+def frame_state(missions, table_cards, player_cards, description):
+    # Compact, picklable copy of everything a frame shows: mission texts and
+    # (color value, number) pairs for the cards
+    return (
+        [f"{m}" if m else None for m in missions],
+        [(c.color.value, c.number) for c in table_cards],
+        [(c.color.value, c.number) if c else None for c in player_cards],
+        description,
+    )
+
+
+def _render_loop(frames, outdir):
+    # Body of the render process: draws frames until it receives None
+    v = Visuals(outdir)
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+        v.draw_frame(*frame)
+
+
+class RenderProcess:
+    """Visuals replacement that draws in a separate process.
+
+    draw() only queues a compact copy of the frame, so the caller never waits for
+    pygame or disk writes. When the renderer falls more than `max_frames` frames
+    behind, new frames are dropped and counted in `dropped`. If the render process
+    dies (e.g. pygame cannot open a display), the following frames are counted in
+    `lost` instead. close() reports both.
+    """
+
+    def __init__(self, outdir, max_frames=256):
+        self.outdir = outdir
+        self.max_frames = max_frames
+        self.process = None
+        self.crashed = None  # Exit code of a render process that died
+        self.dropped = 0
+        self.lost = 0
+
+    def _start(self):
+        # pygame is only initialized in the render process, which is started on
+        # the first frame
+        context = multiprocessing.get_context("fork")
+        self.frames = context.Queue(self.max_frames)
+        self.process = context.Process(
+            target=_render_loop, args=(self.frames, self.outdir), daemon=True
+        )
+        self.process.start()
+        atexit.register(self.close)
+
+    def _died(self):
+        # The render process is gone, its queue is never read again
+        self.crashed = self.process.exitcode
+        self.frames.cancel_join_thread()
+        self.process = None
+        print(f"Render process died (exit code {self.crashed}), frames are not drawn")
+
+    def draw(self, missions, table_cards, player_cards, description):
+        if self.crashed is not None:
+            self.lost += 1
+            return
+        if self.process is None:
+            self._start()
+        elif not self.process.is_alive():
+            self._died()
+            self.lost += 1
+            return
+        try:
+            self.frames.put_nowait(
+                frame_state(missions, table_cards, player_cards, description)
+            )
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=10):
+        # Lets the render process finish the queued frames and stops it
+        if self.process is not None:
+            if self.process.is_alive():
+                try:
+                    self.frames.put(None, timeout=timeout)
+                    self.process.join(timeout)
+                except queue.Full:
+                    pass
+            if self.process.is_alive():
+                self.process.terminate()
+                self.frames.cancel_join_thread()
+                self.process = None
+            elif self.process.exitcode != 0:
+                self._died()
+            else:
+                self.process = None
+
+        if self.crashed is not None:
+            # Frames that did not fit into the queue were lost to the crash as well
+            lost = self.lost + self.dropped
+            if lost:
+                print(f"Rendering lost {lost} frames, the render process died")
+        elif self.dropped:
+            print(f"Rendering dropped {self.dropped} frames, the renderer fell behind")
+        self.dropped = 0
+        self.lost = 0